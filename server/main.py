@@ -8,18 +8,18 @@ from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends,WebSocket,
 from fastapi.responses import StreamingResponse,FileResponse, JSONResponse
 from pathlib import Path
 import mimetypes
+import os
+import shutil
 import asyncio
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, select
 
 import logging
-import uuid
 from pathlib import Path
 from datetime import datetime
-import threading
 import json
 from typing import List, Optional
 from datetime import datetime, timedelta
@@ -31,9 +31,11 @@ from src.tools.discovery_enhanced import discover_with_selectors
 from src.tools.generator import generate_tests, SCENARIO_TEMPLATES
 from src.tools.runner import run_playwright_tests
 from src.tools.auto_healer import auto_heal_and_rerun
-from src.database.connection import get_db, get_db_session, init_db
-from src.database.models import Run, RunLog
+from src.database.connection import engine, get_db, get_async_db, get_db_session, init_db, MAX_CONCURRENT_RUNS
+from src.database.models import Run, RunLog, generate_uuid
+from src.database.state_updater import state_updater
 from src.tools.progress_tracker import progress_tracker
+from src.tools.run_queue import RunQueueManager
 from src.tools.recorder import launch_codegen_recorder
 from pathlib import Path
 logging.basicConfig(level=logging.INFO)
@@ -49,8 +51,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+run_queue = RunQueueManager(max_concurrent=MAX_CONCURRENT_RUNS)
+
 @app.on_event("startup")
 def startup_event():
+    progress_tracker.bind_loop(asyncio.get_running_loop())
+    run_queue.start(run_pipeline_sync)
+    # Schema creation hits the catalog on every worker start; deployments that
+    # manage the schema with migrations can skip it with UIDAI_INIT_DB_ON_STARTUP=0
+    if os.getenv("UIDAI_INIT_DB_ON_STARTUP", "1") != "1":
+        log.info("Skipping database initialization (UIDAI_INIT_DB_ON_STARTUP=0)")
+        return
     try:
         init_db()
         log.info("✅ Database initialized")
@@ -67,15 +78,18 @@ class RunRequest(BaseModel):
     maxHealAttempts: int = 3
     autoHeal: bool = True
     useRecorder: bool = False
+    priority: int = 0  # lower runs sooner
 
 def get_run_dir(run_id: str) -> Path:
     return Path("/tmp/uidai_runs") / run_id
 
-def add_log_to_db(db: Session, run_id: str, message: str):
+def add_log_to_db(db: Session, run_id: str, message: str, commit: bool = True):
+    """Pass commit=False when a state write (or get_db exit) commits right after"""
     try:
         log_entry = RunLog(run_id=run_id, message=message)
         db.add(log_entry)
-        db.commit()
+        if commit:
+            db.commit()
         log.info(f"[{run_id}] {message}")
     except Exception as e:
         log.info(f"[{run_id}] {message}")
@@ -88,203 +102,23 @@ def get_preset_config(preset: str) -> Dict[str, Any]:
     }
     return configs.get(preset, configs["balanced"])
 
-def run_pipeline_sync(run_id: str, config: dict):
-    """Sync pipeline function - runs in background thread"""
-    with get_db() as db:
-        try:
-            url = config["url"]
-            use_recorder = config.get("useRecorder", False)
-            add_log_to_db(db, run_id, f"🚀 Starting pipeline for {url}")
-            # If recorder mode, launch interactive browser FIRST
-            if use_recorder:
-                asyncio.run(progress_tracker.broadcast_progress(
-                    run_id,
-                    progress_tracker.update_phase(
-                        run_id, "starting", "running",
-                        "🎥 Launching Interactive Recorder...", 5
-                    )
-                ))
-                
-                add_log_to_db(db, run_id, "🎥 Launching Interactive Recorder...")
-                add_log_to_db(db, run_id, "👉 Browser will open - perform your test actions")
-                
-                from src.tools.recorder import launch_codegen_recorder
-                from src.tools.runner import get_run_dir
-                
-                recorder_result = launch_codegen_recorder(
-                    run_id=run_id,
-                    url=url,
-                    output_dir=get_run_dir(run_id) / "recorded"
-                )
-                
-                if recorder_result.get("ok"):
-                    recorded_file = recorder_result.get("output_file")
-                    add_log_to_db(db, run_id, f"✅ Recording saved: {recorded_file}")
-                    
-                    # Update progress
-                    asyncio.run(progress_tracker.broadcast_progress(
-                        run_id,
-                        progress_tracker.update_phase(
-                            run_id, "starting", "completed",
-                            "Recording complete!", 10
-                        )
-                    ))
-                else:
-                    error = recorder_result.get("message", "Unknown error")
-                    add_log_to_db(db, run_id, f"⚠️ Recording issue: {error}")
-            
-            run = db.query(Run).filter(Run.id == run_id).first()
-            if run:
-                run.status = "running"
-                run.phase = "discovery"
-                db.commit()
-            
-            preset_config = get_preset_config(config["preset"])
-            
-            # Discovery
-            add_log_to_db(db, run_id, " Phase 1: Discovery...")
-            discovery_result = discover_with_selectors(
-                run_id=run_id,
-                url=url,
-                level=preset_config["level"],
-                max_pages=preset_config["max_pages"]
-            )
-            
-            pages = discovery_result.get("pages", [])
-            selectors_count = sum(len(p.get("selectors", [])) for p in pages)
-            add_log_to_db(db, run_id, f"✓ Found {len(pages)} pages, {selectors_count} selectors")
-            
-            if run:
-                run.discovery_result = discovery_result
-                run.phase = "generation"
-                db.commit()
-            
-            # Generation
-            add_log_to_db(db, run_id, "⚙️ Phase 2: Generating tests...")
-            scenario_param = config.get("scenario", "") or "auto"
-            models = ["qwen2.5-coder:14b"] if config["useOllama"] else []
-            
-            gen_result = generate_tests(
-                run_id=run_id,
-                url=url,
-                pages=pages,
-                scenario=scenario_param,
-                models=models
-            )
-            
-            if not gen_result.get("ok"):
-                raise Exception("Test generation failed")
-            
-            test_count = gen_result.get("count", 0)
-            add_log_to_db(db, run_id, f"✓ Generated {test_count} test(s)")
-            
-            if run:
-                run.generation_result = gen_result
-                run.phase = "execution"
-                db.commit()
-            
-            # Execution
-            add_log_to_db(db, run_id, "🧪 Phase 3: Executing tests...")
-            tests_dir = get_run_dir(run_id) / "generator" / "tests"
-            
-            headed_mode = config.get("mode") == "headed" or config.get("useRecorder", False)
-
-            if config.get("useRecorder"):
-                add_log_to_db(db, run_id, "🎥 Running tests in VISIBLE mode (Recorder)")
-
-            run_result = run_playwright_tests(
-                run_id=run_id,
-                gen_dir=str(tests_dir),
-                headed=headed_mode,  # ← USE THIS VARIABLE
-                timeout_seconds=preset_config["timeout"]
-            )
-            
-            summary = run_result.get("summary", {})
-            passed = int(summary.get("passed", 0))
-            failed = int(summary.get("failed", 0))
-            total = int(summary.get("total", 0))
-            
-            if run:
-                run.execution_result = run_result
-                db.commit()
-            
-            if failed == 0 and passed > 0:
-                add_log_to_db(db, run_id, f"✅ All tests passed! ({passed}/{total})")
-                if run:
-                    run.status = "completed"
-                    run.phase = "completed"
-                    run.completed_at = datetime.utcnow()
-                    db.commit()
-            elif failed > 0 and config.get("autoHeal", True):
-                # Healing
-                add_log_to_db(db, run_id, f"🔧 Phase 4: Auto-healing ({failed} failures)...")
-                if run:
-                    run.phase = "healing"
-                    db.commit()
-                
-                all_tests = run_result.get("tests", [])
-                failed_tests = [t for t in all_tests if t.get("outcome") == "failed"]
-                
-                healing_result = auto_heal_and_rerun(
-                    run_id=run_id,
-                    gen_dir=str(tests_dir),
-                    failed_tests=failed_tests,
-                    summary=summary,
-                    generated_files=[t.get("path", "") for t in gen_result.get("tests", [])],
-                    models=models,
-                    max_attempts=config["maxHealAttempts"],
-                    headed=config["mode"] == "headed",
-                    timeout_seconds=preset_config["timeout"]
-                )
-                
-                if run:
-                    run.healing_result = healing_result
-                    db.commit()
-                
-                if healing_result.get("healed"):
-                    attempts = healing_result.get("healing_attempts", 0)
-                    add_log_to_db(db, run_id, f"✅ Healed after {attempts} attempt(s)!")
-                    if run:
-                        run.status = "completed"
-                        run.execution_result = healing_result.get("final_result")
-                        db.commit()
-                else:
-                    add_log_to_db(db, run_id, "⚠️ Healing incomplete")
-                    if run:
-                        run.status = "failed"
-                        db.commit()
-            else:
-                if run:
-                    run.status = "failed"
-                    db.commit()
-            
-            if run:
-                run.phase = "completed"
-                run.completed_at = datetime.utcnow()
-                db.commit()
-            
-            add_log_to_db(db, run_id, "🏁 Pipeline completed")
-            
-        except Exception as e:
-            log.exception(f"Pipeline failed for {run_id}: {e}")
-            add_log_to_db(db, run_id, f"💥 Failed: {str(e)}")
-            run = db.query(Run).filter(Run.id == run_id).first()
-            if run:
-                run.status = "failed"
-                run.phase = "failed"
-                run.error_message = str(e)
-                run.completed_at = datetime.utcnow()
-                db.commit()
-
 @app.get("/")
 def root():
     return {"name": "UIDAI Testing API", "version": "2.0.0", "status": "running"}
 
 
 @app.get("/api/runs")
-def list_runs(limit: int = 50, db: Session = Depends(get_db_session)):
+def list_runs(limit: int = 50):
     """List all runs"""
-    runs = db.query(Run).order_by(Run.created_at.desc()).limit(limit).all()
+    # Read-only: plain Core select on an autocommit connection, no ORM session
+    stmt = (
+        select(Run.id, Run.target_url, Run.status, Run.phase, Run.mode,
+               Run.preset, Run.created_at, Run.completed_at)
+        .order_by(Run.created_at.desc())
+        .limit(limit)
+    )
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        runs = conn.execute(stmt).all()
     return {
         "runs": [
             {
@@ -304,34 +138,15 @@ def list_runs(limit: int = 50, db: Session = Depends(get_db_session)):
 @app.get("/api/run/{run_id}")
 def get_run(run_id: str, db: Session = Depends(get_db_session)):
     """Get full run data"""
-    run = db.query(Run).filter(Run.id == run_id).first()
-    if not run:
+    state = state_updater.get_run_state(db, run_id)
+    if not state:
         raise HTTPException(status_code=404, detail="Run not found")
-    
-    # Access the stored JSON fields directly from the model
-    return {
-        "runId": run.id,
-        "targetUrl": run.target_url,
-        "status": run.status,
-        "phase": run.phase,
-        "createdAt": run.created_at.isoformat() if run.created_at else None,
-        "completedAt": run.completed_at.isoformat() if run.completed_at else None,
-        "discovery": run.discovery_result,
-        "tests": run.generation_result,
-        "results": run.execution_result,
-        "healing": run.healing_result,
-        "config": {
-            "mode": run.mode,
-            "preset": run.preset,
-            "scenario": run.scenario,
-            "maxHealAttempts": run.max_heal_attempts,
-        },
-    }
+    return state
 
 @app.get("/api/run/{run_id}/discovery")
 def get_discovery(run_id: str, db: Session = Depends(get_db_session)):
     """Get discovery results for a run"""
-    run = db.query(Run).filter(Run.id == run_id).first()
+    run = db.get(Run, run_id)
     if not run:
         raise HTTPException(status_code=404, detail="Run not found")
     
@@ -343,7 +158,7 @@ def get_discovery(run_id: str, db: Session = Depends(get_db_session)):
 @app.get("/api/run/{run_id}/tests")
 def get_tests(run_id: str, db: Session = Depends(get_db_session)):
     """Get generated tests for a run"""
-    run = db.query(Run).filter(Run.id == run_id).first()
+    run = db.get(Run, run_id)
     if not run:
         raise HTTPException(status_code=404, detail="Run not found")
     
@@ -355,7 +170,7 @@ def get_tests(run_id: str, db: Session = Depends(get_db_session)):
 @app.get("/api/run/{run_id}/results")
 def get_results(run_id: str, db: Session = Depends(get_db_session)):
     """Get test results for a run"""
-    run = db.query(Run).filter(Run.id == run_id).first()
+    run = db.get(Run, run_id)
     if not run:
         raise HTTPException(status_code=404, detail="Run not found")
     
@@ -367,7 +182,7 @@ def get_results(run_id: str, db: Session = Depends(get_db_session)):
 @app.get("/api/run/{run_id}/healing")
 def get_healing(run_id: str, db: Session = Depends(get_db_session)):
     """Get healing data for a run"""
-    run = db.query(Run).filter(Run.id == run_id).first()
+    run = db.get(Run, run_id)
     if not run:
         raise HTTPException(status_code=404, detail="Run not found")
     
@@ -377,66 +192,16 @@ def get_healing(run_id: str, db: Session = Depends(get_db_session)):
     return {**run.healing_result, "ok": True}
 
 @app.get("/api/run/{run_id}/logs")
-def get_logs(run_id: str, db: Session = Depends(get_db_session)):
+def get_logs(run_id: str):
     """Get logs for a run"""
-    logs = db.query(RunLog).filter(RunLog.run_id == run_id).order_by(RunLog.timestamp).all()
-    return {"logs": [{"message": l.message, "timestamp": l.timestamp.isoformat()} for l in logs]}
-
-@app.get("/api/run/{run_id}/logs/stream")
-async def stream_logs(run_id: str):
-    """
-    Server-Sent Events endpoint for streaming logs in real-time
-    """
-    async def event_generator():
-        """Generate SSE events from database logs"""
-        last_id = 0
-        
-        try:
-            while True:
-                # Get new logs since last check
-                with get_db() as db:
-                    new_logs = db.query(RunLog)\
-                        .filter(RunLog.run_id == run_id)\
-                        .filter(RunLog.id > last_id)\
-                        .order_by(RunLog.timestamp)\
-                        .all()
-                    
-                    for log in new_logs:
-                        last_id = log.id
-                        # Format as SSE
-                        data = {
-                            "line": log.message,
-                            "timestamp": log.timestamp.isoformat()
-                        }
-                        yield f"data: {json.dumps(data)}\n\n"
-                    
-                    # Check if run is completed
-                    run = db.query(Run).filter(Run.id == run_id).first()
-                    if run and run.status in ["completed", "failed"]:
-                        # Send final message and close
-                        yield f"data: {json.dumps({'line': f'[Stream ended - Run {run.status}]'})}\n\n"
-                        break
-                
-                # Wait before checking for new logs
-                await asyncio.sleep(1)
-                
-        except asyncio.CancelledError:
-            # Client disconnected
-            log.info(f"Client disconnected from log stream for {run_id}")
-        except Exception as e:
-            log.error(f"Error streaming logs for {run_id}: {e}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
-    
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
-        }
+    stmt = (
+        select(RunLog.message, RunLog.timestamp)
+        .where(RunLog.run_id == run_id)
+        .order_by(RunLog.timestamp)
     )
-# Add this to your main.py imports
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        logs = conn.execute(stmt).all()
+    return {"logs": [{"message": l.message, "timestamp": l.timestamp.isoformat()} for l in logs]}
 
 @app.get("/api/run/{run_id}/logs/stream")
 async def stream_logs(run_id: str):
@@ -449,13 +214,14 @@ async def stream_logs(run_id: str):
         
         try:
             while True:
-                # Get new logs since last check
-                with get_db() as db:
-                    new_logs = db.query(RunLog)\
-                        .filter(RunLog.run_id == run_id)\
-                        .filter(RunLog.id > last_id)\
-                        .order_by(RunLog.timestamp)\
-                        .all()
+                # Get new logs since last check (async session - keeps the loop free)
+                async with get_async_db() as db:
+                    new_logs = (await db.execute(
+                        select(RunLog)
+                        .where(RunLog.run_id == run_id)
+                        .where(RunLog.id > last_id)
+                        .order_by(RunLog.timestamp)
+                    )).scalars().all()
                     
                     for log in new_logs:
                         last_id = log.id
@@ -467,10 +233,12 @@ async def stream_logs(run_id: str):
                         yield f"data: {json.dumps(data)}\n\n"
                     
                     # Check if run is completed
-                    run = db.query(Run).filter(Run.id == run_id).first()
-                    if run and run.status in ["completed", "failed"]:
+                    status = (await db.execute(
+                        select(Run.status).where(Run.id == run_id)
+                    )).scalar_one_or_none()
+                    if status in ["completed", "failed"]:
                         # Send final message and close
-                        yield f"data: {json.dumps({'line': f'[Stream ended - Run {run.status}]'})}\n\n"
+                        yield f"data: {json.dumps({'line': f'[Stream ended - Run {status}]'})}\n\n"
                         break
                 
                 # Wait before checking for new logs
@@ -492,10 +260,9 @@ async def stream_logs(run_id: str):
             "X-Accel-Buffering": "no"
         }
     )
-
 @app.post("/api/run")
 def create_run(request: RunRequest, db: Session = Depends(get_db_session)):
-    run_id = str(uuid.uuid4())
+    run_id = generate_uuid()
     run_name = request.runName or f"Run {run_id[:8]}"
     
     run = Run(
@@ -526,11 +293,10 @@ def create_run(request: RunRequest, db: Session = Depends(get_db_session)):
         "useRecorder": request.useRecorder
     }
     
-    # Run in thread to avoid async/sync conflicts
-    thread = threading.Thread(target=run_pipeline_sync, args=(run_id, config), daemon=True)
-    thread.start()
+    # Worker threads run the sync pipeline, bounded by MAX_CONCURRENT_RUNS
+    position = run_queue.enqueue_run(run_id, config, priority=request.priority)
     
-    return {"ok": True, "runId": run_id, "runName": run_name}
+    return {"ok": True, "runId": run_id, "runName": run_name, "queuePosition": position}
 
 
 @app.get("/api/run/{run_id}/artifacts")
@@ -629,7 +395,7 @@ def get_failures_with_screenshots(run_id: str, db: Session = Depends(get_db_sess
     """
     Get failed tests with their associated screenshots
     """
-    run = db.query(Run).filter(Run.id == run_id).first()
+    run = db.get(Run, run_id)
     if not run:
         raise HTTPException(status_code=404, detail="Run not found")
     
@@ -729,16 +495,13 @@ def run_pipeline_sync(run_id: str, config: dict):
                 add_log_to_db(db, run_id, "🎥 Visual Recorder Mode - Manual Test Creation")
                 add_log_to_db(db, run_id, "⏭️ Skipping discovery & AI generation")
                 
-                asyncio.run(progress_tracker.broadcast_progress(
+                progress_tracker.publish(
                     run_id,
                     progress_tracker.update_phase(
                         run_id, "starting", "running",
                         "🎥 Opening browser for recording...", 10
                     )
-                ))
-                
-                # Import recorder
-                
+                )
                 
                 run_dir = get_run_dir(run_id)
                 recorded_dir = run_dir / "recorded"
@@ -762,47 +525,45 @@ def run_pipeline_sync(run_id: str, config: dict):
                 tests_dir = run_dir / "generator" / "tests"
                 tests_dir.mkdir(parents=True, exist_ok=True)
                 
-                import shutil
                 target_file = tests_dir / "test_recorded.py"
                 shutil.copy(recorded_file, target_file)
                 
-                add_log_to_db(db, run_id, f"📝 Recorded test saved to: {target_file.name}")
+                add_log_to_db(db, run_id, f"📝 Recorded test saved to: {target_file.name}", commit=False)
 
                 # Save data to database for UI
-                run = db.query(Run).filter(Run.id == run_id).first()
-                if run:
-                    run.discovery_result = {
+                state_updater.update_from_state(db, run_id, {
+                    "discovery_result": {
                         "ok": True,
                         "pages": [{"url": url, "title": "Manual Recording", "selectors": []}],
                         "stats": {"mode": "recorder"}
-                    }
-                    run.generation_result = {
+                    },
+                    "generation_result": {
                         "ok": True,
                         "count": 1,
                         "tests": [{"name": "test_recorded", "type": "recorded"}],
                         "mode": "recorder"
-                    }
-                    run.phase = "execution"
-                    db.commit()
+                    },
+                    "phase": "execution",
+                })
                 
                 # Update progress - skip to 60% (skip discovery & generation)
-                asyncio.run(progress_tracker.broadcast_progress(
+                progress_tracker.publish(
                     run_id,
                     progress_tracker.update_phase(
                         run_id, "generation", "completed",
                         "Manual test recorded", 60
                     )
-                ))
+                )
                 
                 # Phase 3: Execute ONLY the recorded test
                 add_log_to_db(db, run_id, "🧪 Phase 3: Executing recorded test...")
-                asyncio.run(progress_tracker.broadcast_progress(
+                progress_tracker.publish(
                     run_id,
                     progress_tracker.update_phase(
                         run_id, "execution", "running",
                         "Running recorded test...", 70
                     )
-                ))
+                )
                 
                 preset_config = get_preset_config(config["preset"])
                 
@@ -818,42 +579,41 @@ def run_pipeline_sync(run_id: str, config: dict):
                 failed = int(summary.get("failed", 0))
                 total = int(summary.get("total", 0))
                 
-                asyncio.run(progress_tracker.broadcast_progress(
+                progress_tracker.publish(
                     run_id,
                     progress_tracker.update_phase(
                         run_id, "execution", "completed",
                         f"{passed}/{total} tests passed", 85
                     )
-                ))
+                )
                 
-                run = db.query(Run).filter(Run.id == run_id).first()
-                if run:
-                    run.execution_result = run_result
-                    run.status = "completed" if passed == total else "failed"
-                    run.phase = "completed"
-                    run.completed_at = datetime.utcnow()
-                    db.commit()
+                state_updater.update_from_state(db, run_id, {
+                    "execution_result": run_result,
+                    "status": "completed" if passed == total else "failed",
+                    "phase": "completed",
+                    "completed_at": datetime.utcnow(),
+                })
                 
                 if passed == total:
-                    add_log_to_db(db, run_id, f"✅ Recorded test passed! ({passed}/{total})")
-                    asyncio.run(progress_tracker.broadcast_progress(
+                    add_log_to_db(db, run_id, f"✅ Recorded test passed! ({passed}/{total})", commit=False)
+                    progress_tracker.publish(
                         run_id,
                         progress_tracker.update_phase(
                             run_id, "completed", "success",
                             f"Recorded test passed!", 100
                         )
-                    ))
+                    )
                 else:
-                    add_log_to_db(db, run_id, f"⚠️ Recorded test failed ({passed}/{total})")
-                    asyncio.run(progress_tracker.broadcast_progress(
+                    add_log_to_db(db, run_id, f"⚠️ Recorded test failed ({passed}/{total})", commit=False)
+                    progress_tracker.publish(
                         run_id,
                         progress_tracker.update_phase(
                             run_id, "completed", "failed",
                             f"Test failed", 100
                         )
-                    ))
+                    )
                 
-                add_log_to_db(db, run_id, "🏁 Pipeline completed")
+                add_log_to_db(db, run_id, "🏁 Pipeline completed", commit=False)
                 return  # ← EXIT HERE - Skip normal pipeline
             
             # ============================================================
@@ -861,31 +621,27 @@ def run_pipeline_sync(run_id: str, config: dict):
             # ============================================================
             
             # Update: Starting
-            asyncio.run(progress_tracker.broadcast_progress(
+            progress_tracker.publish(
                 run_id,
                 progress_tracker.update_phase(
                     run_id, "starting", "running", 
                     "Initializing test run...", 5
                 )
-            ))
+            )
             
-            run = db.query(Run).filter(Run.id == run_id).first()
-            if run:
-                run.status = "running"
-                run.phase = "discovery"
-                db.commit()
+            state_updater.update_from_state(db, run_id, {"status": "running", "phase": "discovery"})
             
             preset_config = get_preset_config(config["preset"])
             
             # Phase 1: Discovery
             add_log_to_db(db, run_id, "📡 Phase 1: Discovery...")
-            asyncio.run(progress_tracker.broadcast_progress(
+            progress_tracker.publish(
                 run_id,
                 progress_tracker.update_phase(
                     run_id, "discovery", "running",
                     f"Discovering pages on {url}...", 10 if not use_recorder else 25
                 )
-            ))
+            )
             
             discovery_result = discover_with_selectors(
                 run_id=run_id,
@@ -896,30 +652,30 @@ def run_pipeline_sync(run_id: str, config: dict):
             
             pages = discovery_result.get("pages", [])
             selectors_count = sum(len(p.get("selectors", [])) for p in pages)
-            add_log_to_db(db, run_id, f"✓ Found {len(pages)} pages, {selectors_count} selectors")
+            add_log_to_db(db, run_id, f"✓ Found {len(pages)} pages, {selectors_count} selectors", commit=False)
             
-            asyncio.run(progress_tracker.broadcast_progress(
+            progress_tracker.publish(
                 run_id,
                 progress_tracker.update_phase(
                     run_id, "discovery", "completed",
                     f"Found {len(pages)} pages, {selectors_count} elements", 30 if not use_recorder else 40
                 )
-            ))
+            )
             
-            if run:
-                run.discovery_result = discovery_result
-                run.phase = "generation"
-                db.commit()
+            state_updater.update_from_state(db, run_id, {
+                "discovery_result": discovery_result,
+                "phase": "generation",
+            })
             
             # Phase 2: Generation
             add_log_to_db(db, run_id, "⚙️ Phase 2: Generating tests...")
-            asyncio.run(progress_tracker.broadcast_progress(
+            progress_tracker.publish(
                 run_id,
                 progress_tracker.update_phase(
                     run_id, "generation", "running",
                     "AI is generating test cases...", 40 if not use_recorder else 50
                 )
-            ))
+            )
             
             scenario_param = config.get("scenario", "") or "auto"
             models = ["qwen2.5-coder:14b"] if config["useOllama"] else []
@@ -940,32 +696,32 @@ def run_pipeline_sync(run_id: str, config: dict):
             # If recorder was used, add to count
             if use_recorder:
                 test_count += 1  # Add the recorded test
-                add_log_to_db(db, run_id, f"✓ Generated {test_count} test(s) (1 recorded + {test_count-1} AI-generated)")
+                add_log_to_db(db, run_id, f"✓ Generated {test_count} test(s) (1 recorded + {test_count-1} AI-generated)", commit=False)
             else:
-                add_log_to_db(db, run_id, f"✓ Generated {test_count} test(s)")
+                add_log_to_db(db, run_id, f"✓ Generated {test_count} test(s)", commit=False)
             
-            asyncio.run(progress_tracker.broadcast_progress(
+            progress_tracker.publish(
                 run_id,
                 progress_tracker.update_phase(
                     run_id, "generation", "completed",
                     f"Generated {test_count} tests", 60
                 )
-            ))
+            )
             
-            if run:
-                run.generation_result = gen_result
-                run.phase = "execution"
-                db.commit()
+            state_updater.update_from_state(db, run_id, {
+                "generation_result": gen_result,
+                "phase": "execution",
+            })
             
             # Phase 3: Execution
             add_log_to_db(db, run_id, "🧪 Phase 3: Executing tests...")
-            asyncio.run(progress_tracker.broadcast_progress(
+            progress_tracker.publish(
                 run_id,
                 progress_tracker.update_phase(
                     run_id, "execution", "running",
                     f"Running {test_count} tests...", 70
                 )
-            ))
+            )
             
             tests_dir = get_run_dir(run_id) / "generator" / "tests"
             
@@ -987,47 +743,40 @@ def run_pipeline_sync(run_id: str, config: dict):
             failed = int(summary.get("failed", 0))
             total = int(summary.get("total", 0))
             
-            asyncio.run(progress_tracker.broadcast_progress(
+            progress_tracker.publish(
                 run_id,
                 progress_tracker.update_phase(
                     run_id, "execution", "completed",
                     f"{passed}/{total} tests passed", 85
                 )
-            ))
+            )
             
-            if run:
-                run.execution_result = run_result
-                db.commit()
+            # Staged: every branch below writes its own transition right after
+            state_updater.stage(run_id, {"execution_result": run_result})
             
             if failed == 0 and passed > 0:
-                add_log_to_db(db, run_id, f"✅ All tests passed! ({passed}/{total})")
-                asyncio.run(progress_tracker.broadcast_progress(
+                add_log_to_db(db, run_id, f"✅ All tests passed! ({passed}/{total})", commit=False)
+                progress_tracker.publish(
                     run_id,
                     progress_tracker.update_phase(
                         run_id, "completed", "success",
                         f"All {passed} tests passed!", 100
                     )
-                ))
-                if run:
-                    run.status = "completed"
-                    run.phase = "completed"
-                    run.completed_at = datetime.utcnow()
-                    db.commit()
+                )
+                state_updater.stage(run_id, {"status": "completed"})
                     
             elif failed > 0 and config.get("autoHeal", True):
                 # Phase 4: Healing
-                add_log_to_db(db, run_id, f"🔧 Phase 4: Auto-healing ({failed} failures)...")
-                asyncio.run(progress_tracker.broadcast_progress(
+                add_log_to_db(db, run_id, f"🔧 Phase 4: Auto-healing ({failed} failures)...", commit=False)
+                progress_tracker.publish(
                     run_id,
                     progress_tracker.update_phase(
                         run_id, "healing", "running",
                         f"AI is fixing {failed} failed tests...", 90
                     )
-                ))
+                )
                 
-                if run:
-                    run.phase = "healing"
-                    db.commit()
+                state_updater.update_from_state(db, run_id, {"phase": "healing"})
                 
                 all_tests = run_result.get("tests", [])
                 failed_tests = [t for t in all_tests if t.get("outcome") == "failed"]
@@ -1044,72 +793,68 @@ def run_pipeline_sync(run_id: str, config: dict):
                     timeout_seconds=preset_config["timeout"]
                 )
                 
-                if run:
-                    run.healing_result = healing_result
-                    db.commit()
+                state_updater.stage(run_id, {"healing_result": healing_result})
                 
                 if healing_result.get("healed"):
                     attempts = healing_result.get("healing_attempts", 0)
-                    add_log_to_db(db, run_id, f"✅ Healed after {attempts} attempt(s)!")
-                    asyncio.run(progress_tracker.broadcast_progress(
+                    add_log_to_db(db, run_id, f"✅ Healed after {attempts} attempt(s)!", commit=False)
+                    progress_tracker.publish(
                         run_id,
                         progress_tracker.update_phase(
                             run_id, "completed", "success",
                             f"Tests healed after {attempts} attempts!", 100
                         )
-                    ))
-                    if run:
-                        run.status = "completed"
-                        run.execution_result = healing_result.get("final_result")
-                        db.commit()
+                    )
+                    state_updater.stage(run_id, {
+                        "status": "completed",
+                        "execution_result": healing_result.get("final_result"),
+                    })
                 else:
-                    add_log_to_db(db, run_id, "⚠️ Healing incomplete")
-                    asyncio.run(progress_tracker.broadcast_progress(
+                    add_log_to_db(db, run_id, "⚠️ Healing incomplete", commit=False)
+                    progress_tracker.publish(
                         run_id,
                         progress_tracker.update_phase(
                             run_id, "completed", "partial",
                             "Some tests still failing", 100
                         )
-                    ))
-                    if run:
-                        run.status = "failed"
-                        db.commit()
+                    )
+                    state_updater.stage(run_id, {"status": "failed"})
             else:
-                asyncio.run(progress_tracker.broadcast_progress(
+                progress_tracker.publish(
                     run_id,
                     progress_tracker.update_phase(
                         run_id, "completed", "failed",
                         f"{failed} tests failed", 100
                     )
-                ))
-                if run:
-                    run.status = "failed"
-                    db.commit()
+                )
+                state_updater.stage(run_id, {"status": "failed"})
             
-            if run:
-                run.phase = "completed"
-                run.completed_at = datetime.utcnow()
-                db.commit()
+            # Flushes the staged status/results together with the terminal phase
+            state_updater.update_from_state(db, run_id, {
+                "phase": "completed",
+                "completed_at": datetime.utcnow(),
+            })
             
-            add_log_to_db(db, run_id, "🏁 Pipeline completed")
+            add_log_to_db(db, run_id, "🏁 Pipeline completed", commit=False)
             
         except Exception as e:
             log.exception(f"Pipeline failed for {run_id}: {e}")
-            add_log_to_db(db, run_id, f"💥 Failed: {str(e)}")
-            asyncio.run(progress_tracker.broadcast_progress(
+            add_log_to_db(db, run_id, f"💥 Failed: {str(e)}", commit=False)
+            progress_tracker.publish(
                 run_id,
                 progress_tracker.update_phase(
                     run_id, "failed", "error",
                     f"Error: {str(e)}", 0
                 )
-            ))
-            run = db.query(Run).filter(Run.id == run_id).first()
-            if run:
-                run.status = "failed"
-                run.phase = "failed"
-                run.error_message = str(e)
-                run.completed_at = datetime.utcnow()
-                db.commit()
+            )
+            state_updater.update_from_state(db, run_id, {
+                "status": "failed",
+                "phase": "failed",
+                "error_message": str(e),
+                "completed_at": datetime.utcnow(),
+            })
+        finally:
+            progress_tracker.finish_run(run_id)
 
 # Add these endpoints to server/src/api/routes.py
 
@@ -1123,7 +868,7 @@ def run_pipeline_sync(run_id: str, config: dict):
 # ============================================================
 
 @app.get("/api/runs/compare")
-async def compare_runs(
+def compare_runs(
     run_ids: str = Query(..., description="Comma-separated run IDs")
 ):
     """
@@ -1142,7 +887,7 @@ async def compare_runs(
     with get_db() as db:
         runs = []
         for run_id in run_id_list:
-            run = db.query(Run).filter(Run.id == run_id).first()
+            run = db.get(Run, run_id)
             if not run:
                 raise HTTPException(404, f"Run {run_id} not found")
             runs.append(run)
@@ -1172,10 +917,7 @@ async def compare_runs(
             
             pass_rate = (passed / total * 100) if total > 0 else 0
             
-            # Calculate duration
-            duration = 0
-            if run.completed_at and run.created_at:
-                duration = (run.completed_at - run.created_at).total_seconds()
+            duration = run.duration_seconds or 0
             
             total_pass_rate += pass_rate
             total_duration += duration
@@ -1239,7 +981,7 @@ async def compare_runs(
 # ============================================================
 
 @app.get("/api/runs/trends")
-async def get_trends(
+def get_trends(
     days: int = Query(7, description="Number of days to analyze"),
     url: Optional[str] = Query(None, description="Filter by target URL")
 ):
@@ -1289,9 +1031,8 @@ async def get_trends(
             pass_rate = (passed / total * 100) if total > 0 else 0
             all_pass_rates.append(pass_rate)
             
-            duration = 0
-            if run.completed_at and run.created_at:
-                duration = (run.completed_at - run.created_at).total_seconds()
+            duration = run.duration_seconds or 0
+            if run.duration_seconds is not None:
                 all_durations.append(duration)
             
             total_tests += total
@@ -1338,7 +1079,7 @@ async def get_trends(
 
 
 @app.get("/api/runs/flaky-tests")
-async def get_flaky_tests(
+def get_flaky_tests(
     days: int = Query(7, description="Number of days to analyze"),
     min_runs: int = Query(3, description="Minimum runs to consider")
 ):
@@ -1408,7 +1149,7 @@ async def get_flaky_tests(
 
 
 @app.get("/api/runs/stats")
-async def get_overall_stats():
+def get_overall_stats():
     """
     Get overall platform statistics
     
@@ -1425,20 +1166,15 @@ async def get_overall_stats():
             Run.status == "failed"
         ).scalar()
         
-        # Get all execution results
-        runs_with_results = db.query(Run).filter(
+        # Sum test counters in SQL instead of loading every run's JSON columns
+        summary = Run.execution_result["summary"]
+        total_tests, total_passed, total_failed = db.query(
+            func.coalesce(func.sum(summary["total"].as_integer()), 0),
+            func.coalesce(func.sum(summary["passed"].as_integer()), 0),
+            func.coalesce(func.sum(summary["failed"].as_integer()), 0),
+        ).filter(
             Run.execution_result.isnot(None)
-        ).all()
-        
-        total_tests = 0
-        total_passed = 0
-        total_failed = 0
-        
-        for run in runs_with_results:
-            summary = run.execution_result.get("summary", {})
-            total_tests += int(summary.get("total", 0))
-            total_passed += int(summary.get("passed", 0))
-            total_failed += int(summary.get("failed", 0))
+        ).one()
         
         # Recent activity (last 24 hours)
         last_24h = datetime.utcnow() - timedelta(hours=24)
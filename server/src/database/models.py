@@ -2,16 +2,26 @@
 """
 SQLAlchemy Database Models
 """
-from sqlalchemy import Column, String, Integer, JSON, DateTime, Text, Boolean, ForeignKey
+from sqlalchemy import Column, String, Integer, JSON, DateTime, Text, Boolean, ForeignKey, Float, cast, func
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, column_property
 from datetime import datetime
+import secrets
+import time
 import uuid
 
 Base = declarative_base()
 
 def generate_uuid():
-    return str(uuid.uuid4())
+    """
+    Time-ordered UUIDv7 (48-bit unix ms timestamp + random bits).
+    Monotone keys land at the tail of the primary-key B-tree, so inserts
+    touch fewer pages than fully random uuid4 values.
+    """
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(secrets.token_bytes(10), "big")
+    value = (value & ~(0xF << 76)) | (0x7 << 76)   # version 7
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)   # RFC 4122 variant
+    return str(uuid.UUID(int=value))
 
 class Run(Base):
     """Test Run Model"""
@@ -40,6 +50,11 @@ class Run(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
     
+    # Run duration computed by the database when the row is loaded (NULL until completed)
+    duration_seconds = column_property(
+        cast(func.extract("epoch", completed_at - created_at), Float)
+    )
+    
     # Relationships
     logs = relationship("RunLog", back_populates="run", cascade="all, delete-orphan")
     artifacts = relationship("Artifact", back_populates="run", cascade="all, delete-orphan")
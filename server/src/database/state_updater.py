@@ -0,0 +1,140 @@
+# server/src/database/state_updater.py
+"""
+Run state persistence - single-statement UPDATEs for pipeline transitions
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+from .models import Run
+
+log = logging.getLogger(__name__)
+
+# Columns the pipeline may write (never the key or creation metadata)
+_RUN_COLUMNS = frozenset(c.name for c in Run.__table__.columns)
+_WRITABLE_COLUMNS = _RUN_COLUMNS - {"id", "created_at"}
+
+# Run state snapshots are polled by the UI; a short TTL matches progress granularity
+_RUN_STATE_TTL_SECONDS = 1.0
+_RUN_STATE_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=64)
+def _run_update_statement(columns: Tuple[str, ...]):
+    """
+    Build (once per column set) the UPDATE for a run.
+
+    Bound parameters keep the statement identical across calls, so SQLAlchemy's
+    compiled cache is hit instead of re-compiling per write. The write is blind:
+    pipeline sessions never load the Run, so ORM identity-map synchronization
+    is skipped and the statement runs as plain Core.
+    """
+    return (
+        update(Run)
+        .where(Run.id == bindparam("run_id"))
+        .values({c: bindparam(f"v_{c}") for c in columns})
+        .returning(Run.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _serialize_run(run: Run) -> Dict[str, Any]:
+    """Build the API view of a run from the stored columns"""
+    return {
+        "runId": run.id,
+        "targetUrl": run.target_url,
+        "status": run.status,
+        "phase": run.phase,
+        "createdAt": run.created_at.isoformat() if run.created_at else None,
+        "completedAt": run.completed_at.isoformat() if run.completed_at else None,
+        "discovery": run.discovery_result,
+        "tests": run.generation_result,
+        "results": run.execution_result,
+        "healing": run.healing_result,
+        "config": {
+            "mode": run.mode,
+            "preset": run.preset,
+            "scenario": run.scenario,
+            "maxHealAttempts": run.max_heal_attempts,
+        },
+    }
+
+
+class StateUpdater:
+    """Writes pipeline state transitions to the runs table"""
+
+    __slots__ = ("_cache", "_pending", "_lock")
+
+    def __init__(self):
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()  # run_id -> (expires_at, state)
+        self._pending: Dict[str, Dict[str, Any]] = {}  # run_id -> staged state
+        self._lock = threading.Lock()
+
+    def stage(self, run_id: str, state: Dict[str, Any]):
+        """
+        Stage state for a run without writing it.
+
+        Staged keys are merged into the next update_from_state call, so
+        back-to-back transitions cost one UPDATE instead of several.
+        """
+        with self._lock:
+            self._pending.setdefault(run_id, {}).update(state)
+
+    def update_from_state(self, db: Session, run_id: str, state: Dict[str, Any]):
+        """
+        Persist the known keys of `state` (plus anything staged) for a run with one UPDATE.
+
+        Skips the SELECT + attribute-mutation round trip; unknown keys are ignored.
+        """
+        with self._lock:
+            pending = self._pending.pop(run_id, None)
+        if pending:
+            state = {**pending, **state}
+        columns = tuple(sorted(state.keys() & _WRITABLE_COLUMNS))
+        if not columns:
+            return
+        params = {f"v_{c}": state[c] for c in columns}
+        params["run_id"] = run_id
+        # RETURNING folds the missing-run check into the write itself
+        result = db.execute(_run_update_statement(columns), params)
+        updated = result.first()
+        db.commit()
+        if updated is None:
+            log.warning(f"Run {run_id} not found; state update dropped")
+            return
+        self.invalidate(run_id)
+
+    def get_run_state(self, db: Session, run_id: str) -> Optional[Dict[str, Any]]:
+        """Get the API view of a run, served from a short-lived cache when fresh"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(run_id)
+            if cached and cached[0] > now:
+                return cached[1]
+
+        run = db.get(Run, run_id)
+        if not run:
+            return None
+        state = _serialize_run(run)
+
+        with self._lock:
+            self._cache[run_id] = (now + _RUN_STATE_TTL_SECONDS, state)
+            self._cache.move_to_end(run_id)
+            while len(self._cache) > _RUN_STATE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return state
+
+    def invalidate(self, run_id: str):
+        """Drop the cached snapshot so readers see a write immediately"""
+        with self._lock:
+            self._cache.pop(run_id, None)
+
+
+# Global updater instance
+state_updater = StateUpdater()
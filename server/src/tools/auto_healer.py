@@ -4,12 +4,25 @@ Auto-Healing Module
 Matches healer.py signature: apply_patch(patch, generated_tests_dir)
 """
 import logging
-import shutil
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+
+from .healer import get_heal_suggestions, apply_patch
+from .runner import run_playwright_tests
 
 log = logging.getLogger(__name__)
 
+def _snapshot_files(paths: List[Path]) -> Dict[Path, Optional[bytes]]:
+    """Capture file contents (None = did not exist) so they can be put back"""
+    return {p: (p.read_bytes() if p.is_file() else None) for p in paths}
+
+def _restore_files(snapshot: Dict[Path, Optional[bytes]]):
+    for p, data in snapshot.items():
+        if data is None:
+            p.unlink(missing_ok=True)
+        else:
+            p.write_bytes(data)
+
 def auto_heal_and_rerun(
     run_id: str,
     gen_dir: str,
@@ -35,10 +48,6 @@ def auto_heal_and_rerun(
     """
     log.info(f"[{run_id}] Starting auto-healing loop (max {max_attempts} attempts)")
     
-    # Import here to avoid circular imports
-    from .healer import get_heal_suggestions, apply_patch
-    from .runner import run_playwright_tests
-    
     attempts = []
     
     for attempt_num in range(1, max_attempts + 1):
@@ -53,7 +62,9 @@ def auto_heal_and_rerun(
                     "summary": summary
                 },
                 generated_files=generated_files,
-                models=models
+                models=models,
+                # a retry must ask the model again, not replay the fix that just failed
+                use_cache=attempt_num == 1
             )
         except Exception as e:
             log.error(f"[{run_id}] Failed to get healing suggestions: {e}")
@@ -71,14 +82,6 @@ def auto_heal_and_rerun(
         confidence = best_suggestion.get('confidence', 'unknown')
         log.info(f"[{run_id}] Selected suggestion with confidence: {confidence}")
         
-        # Create backup before applying patch
-        backup_dir = Path(gen_dir).parent / f"tests_backup_attempt_{attempt_num}"
-        try:
-            shutil.copytree(gen_dir, backup_dir, dirs_exist_ok=True)
-            log.info(f"[{run_id}] Backed up tests to {backup_dir}")
-        except Exception as e:
-            log.error(f"[{run_id}] Failed to backup: {e}")
-        
         # Prepare patch dict for apply_patch
         # The healer's apply_patch expects: patch dict with 'file' and 'content' keys
         test_file = best_suggestion.get("file")
@@ -101,6 +104,15 @@ def auto_heal_and_rerun(
         elif "patch" in best_suggestion:
             patch_dict["content"] = best_suggestion["patch"]
         
+        # apply_patch only writes the target file and its .bak, so snapshot just
+        # those instead of copying the whole tests directory every attempt
+        target = Path(gen_dir) / patch_dict["file"]
+        backup = None
+        try:
+            backup = _snapshot_files([target, target.with_suffix(target.suffix + ".bak")])
+        except Exception as e:
+            log.error(f"[{run_id}] Failed to backup: {e}")
+        
         # Apply the patch using correct signature: apply_patch(patch, generated_tests_dir)
         try:
             log.info(f"[{run_id}] Applying patch to {test_file}...")
@@ -109,10 +121,9 @@ def auto_heal_and_rerun(
             if not apply_result.get("ok"):
                 log.error(f"[{run_id}] Failed to apply patch: {apply_result.get('message')}")
                 # Restore from backup
-                if backup_dir.exists():
+                if backup is not None:
                     try:
-                        shutil.rmtree(gen_dir)
-                        shutil.copytree(backup_dir, gen_dir)
+                        _restore_files(backup)
                         log.info(f"[{run_id}] Restored from backup")
                     except Exception as e:
                         log.error(f"[{run_id}] Failed to restore: {e}")
@@ -123,10 +134,9 @@ def auto_heal_and_rerun(
         except Exception as e:
             log.exception(f"[{run_id}] Error applying patch: {e}")
             # Restore from backup
-            if backup_dir.exists():
+            if backup is not None:
                 try:
-                    shutil.rmtree(gen_dir)
-                    shutil.copytree(backup_dir, gen_dir)
+                    _restore_files(backup)
                     log.info(f"[{run_id}] Restored from backup")
                 except Exception as e2:
                     log.error(f"[{run_id}] Failed to restore: {e2}")
@@ -202,11 +212,6 @@ def select_best_suggestion(suggestions: List[Dict[str, Any]]) -> Dict[str, Any]:
     if not suggestions:
         return {}
     
-    # Sort by confidence if available
-    sorted_suggestions = sorted(
-        suggestions,
-        key=lambda s: float(s.get("confidence", 0.5)),
-        reverse=True
-    )
-    
-    return sorted_suggestions[0]
\ No newline at end of file
+    # Coerce each confidence once; highest wins, ties keep the earlier suggestion
+    scores = [float(s.get("confidence", 0.5)) for s in suggestions]
+    return suggestions[max(range(len(scores)), key=scores.__getitem__)]
\ No newline at end of file
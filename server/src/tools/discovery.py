@@ -1,6 +1,9 @@
 # server/src/tools/discovery.py
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List
 from urllib.parse import urljoin, urlparse
 import os, json, time, logging
@@ -8,59 +11,104 @@ from pathlib import Path
 
 log = logging.getLogger(__name__)
 
-def _short_selector_candidate(el):
-    if el is None:
-        return None
-    if el.has_attr("id"):
-        return f"#{el['id']}"
-    if el.has_attr("class"):
-        # take up to 2 classes
-        classes = ".".join([c for c in el.get("class")[:2]])
-        return f"{el.name}.{classes}"
-    return el.name
+# lxml's C tree builder parses several times faster than the pure-Python
+# html.parser, which is kept only as a fallback when lxml is not installed
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
 
-def extract_selectors(soup: BeautifulSoup) -> List[Dict[str, str]]:
+# Pages fetched concurrently per crawl round (shares one pooled session)
+DISCOVERY_FETCH_WORKERS = int(os.getenv("DISCOVERY_FETCH_WORKERS", "8"))
+_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+def _write_bytes(path: Path, data: bytes):
+    try:
+        path.write_bytes(data)
+    except OSError as e:
+        log.exception("Failed to save page snapshot %s: %s", path, e)
+
+# Tags extract_selectors reports on; also the source of crawl links ('a')
+_SELECTOR_TAGS = ["button", "a", "input", "form", "h1", "h2", "h3"]
+
+def extract_selectors(soup: BeautifulSoup, tags: List = None) -> List[Dict[str, str]]:
+    """`tags` is soup.find_all(_SELECTOR_TAGS) when the caller already has it"""
+    if tags is None:
+        tags = soup.find_all(_SELECTOR_TAGS)
     selectors = []
-    for b in soup.select("button, a, input, form, h1, h2, h3"):
-        text = b.get_text(strip=True)[:200] if b.get_text() else ""
-        sel = _short_selector_candidate(b)
-        selectors.append({"selector": sel, "text": text})
+    for b in tags:
+        # one text extraction per element; the id/class lookups hit the attrs dict once
+        attrs = b.attrs
+        if "id" in attrs:
+            sel = f"#{attrs['id']}"
+        else:
+            classes = attrs.get("class")
+            sel = f"{b.name}.{'.'.join(classes[:2])}" if classes is not None else b.name
+        selectors.append({"selector": sel, "text": b.get_text(strip=True)[:200]})
     return selectors
 
 def discover(run_id: str, url: str, level: int = 1, max_pages: int = 10, out_dir: str = "/tmp/uidai_runs") -> Dict[str, Any]:
     out_base = Path(out_dir) / run_id / "discovery"
     out_base.mkdir(parents=True, exist_ok=True)
     visited = set()
-    to_visit = [url]
+    to_visit = deque([url])
+    enqueued = {url}  # everything ever put on to_visit; O(1) duplicate check
+    base = urlparse(url).netloc
     pages = []
     start = time.time()
 
-    while to_visit and len(visited) < max_pages:
-        cur = to_visit.pop(0)
-        if cur in visited:
-            continue
-        try:
-            resp = requests.get(cur, timeout=30, headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            })
-            resp.raise_for_status()
-            soup = BeautifulSoup(resp.text, "html.parser")
-            title = soup.title.string.strip() if soup.title else ""
-            sels = extract_selectors(soup)
-            filename = f"page_{len(pages)}.html"
-            (out_base / filename).write_text(resp.text, encoding="utf-8")
-            pages.append({"url": cur, "title": title, "selectors": sels, "html_path": str(out_base/filename)})
-            visited.add(cur)
+    workers = max(1, min(DISCOVERY_FETCH_WORKERS, max_pages))
+    session = requests.Session()
+    session.headers["User-Agent"] = _USER_AGENT
+    # keep-alive connections for every worker, so TLS handshakes are reused
+    session.mount("http://", HTTPAdapter(pool_maxsize=workers))
+    session.mount("https://", HTTPAdapter(pool_maxsize=workers))
+
+    def _fetch(u: str):
+        resp = session.get(u, timeout=30)
+        resp.raise_for_status()
+        return resp
+
+    # page snapshots are written off the crawl path; leaving the block flushes them
+    with session, ThreadPoolExecutor(max_workers=workers) as ex, \
+            ThreadPoolExecutor(max_workers=2) as writer:
+        while to_visit and len(visited) < max_pages:
+            # take the next round of URLs, never more than the page budget left
+            batch = []
+            while to_visit and len(visited) + len(batch) < max_pages:
+                cur = to_visit.popleft()
+                if cur not in visited and cur not in batch:
+                    batch.append(cur)
+            futures = [(cur, ex.submit(_fetch, cur)) for cur in batch]
+
+            # consume in crawl order so page numbering stays deterministic
+            for cur, fut in futures:
+                try:
+                    resp = fut.result()
+                    # parse the raw bytes; decoding happens once, inside the parser
+                    soup = BeautifulSoup(resp.content, HTML_PARSER, from_encoding=resp.encoding)
+                    title = soup.title.string.strip() if soup.title else ""
+                    # one walk serves both the selectors and the links below
+                    tags = soup.find_all(_SELECTOR_TAGS)
+                    sels = extract_selectors(soup, tags)
+                    filename = f"page_{len(pages)}.html"
+                    # raw response bytes: no decode/re-encode round trip
+                    writer.submit(_write_bytes, out_base / filename, resp.content)
+                    pages.append({"url": cur, "title": title, "selectors": sels, "html_path": str(out_base/filename)})
+                    visited.add(cur)
 
-            if level > 1:
-                base = urlparse(url).netloc
-                for a in soup.find_all("a", href=True):
-                    href = urljoin(cur, a["href"])
-                    if urlparse(href).netloc == base and href not in visited and href not in to_visit:
-                        to_visit.append(href)
-        except Exception as e:
-            log.exception("Discovery error for %s: %s", cur, e)
-            pages.append({"url": cur, "error": str(e)})
+                    if level > 1:
+                        for a in tags:
+                            if a.name != "a" or not a.has_attr("href"):
+                                continue
+                            href = urljoin(cur, a["href"])
+                            if href not in enqueued and urlparse(href).netloc == base:
+                                enqueued.add(href)
+                                to_visit.append(href)
+                except Exception as e:
+                    log.exception("Discovery error for %s: %s", cur, e)
+                    pages.append({"url": cur, "error": str(e)})
     meta = {"runId": run_id, "start": start, "end": time.time(), "count": len(pages)}
     (out_base / "summary.json").write_text(json.dumps({"pages": pages, "meta": meta}, default=str), encoding="utf-8")
     return {"pages": pages, "metadata": meta}
\ No newline at end of file
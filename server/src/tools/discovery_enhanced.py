@@ -1,70 +1,329 @@
 # server/src/tools/discovery_enhanced_py313.py
 """
-Enhanced Discovery Module - Python 3.13 Compatible
-Uses html.parser instead of lxml
+Enhanced Discovery Module
+Parses with lxml (html.parser only if lxml is not installed)
 """
+import atexit
 import logging
-from playwright.sync_api import sync_playwright
-from bs4 import BeautifulSoup
-from typing import List, Dict, Any
+import multiprocessing
+import os
+import queue
+import re
+import threading
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from multiprocessing.pool import Pool
+from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+from bs4 import BeautifulSoup, SoupStrainer
+from typing import List, Dict, Any, Tuple
 from pathlib import Path
+from urllib.parse import urljoin
+from .discovery import HTML_PARSER
 
 log = logging.getLogger(__name__)
 
-def discover_with_selectors(run_id: str, url: str, level: int = 1, max_pages: int = 10) -> Dict[str, Any]:
+# Browsers crawling in parallel; each worker thread owns its own Playwright
+# instance because sync Playwright objects must stay on the creating thread
+DISCOVERY_BROWSER_WORKERS = int(os.getenv("DISCOVERY_BROWSER_WORKERS", "4"))
+
+# HTML parsing runs in worker processes (0 = in the crawl thread), each page
+# bounded by DISCOVERY_PARSE_TIMEOUT seconds
+DISCOVERY_PARSE_WORKERS = int(os.getenv("DISCOVERY_PARSE_WORKERS", str(min(DISCOVERY_BROWSER_WORKERS, os.cpu_count() or 1))))
+DISCOVERY_PARSE_TIMEOUT = float(os.getenv("DISCOVERY_PARSE_TIMEOUT", "10"))
+_parse_pool: "Pool | None" = None
+_parse_pool_lock = threading.Lock()
+
+_CONTENT_SELECTOR = "a, form, button"
+
+# Resource types discovery never reads; aborted so page loads fetch only documents,
+# scripts and XHR. Stylesheets stay unless DISCOVERY_BLOCK_STYLESHEETS=1, since
+# the visibility check reads computed styles.
+_BLOCKED_RESOURCE_TYPES = frozenset(
+    ["image", "media", "font"]
+    + (["stylesheet"] if os.getenv("DISCOVERY_BLOCK_STYLESHEETS", "0") == "1" else [])
+)
+
+_CONTEXT_OPTIONS = dict(
+    viewport={'width': 1920, 'height': 1080},
+    user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
+)
+
+# Shared crawl workers (see _shared_pool); Chromium launches once per worker
+# thread for the life of the process instead of once per discovery call
+_pool_tasks: "queue.Queue | None" = None
+_pool_workers: List[threading.Thread] = []
+_pool_lock = threading.Lock()
+
+# Selectors kept per page (the first ones in tag order, deduplicated)
+_MAX_PAGE_SELECTORS = 50
+
+# Collects interactive elements with selector, visibility and position info
+_INTERACTIVE_ELEMENTS_JS = """
+() => {
+    const getSelector = (el) => {
+        if (el.id) return `#${el.id}`;
+        if (el.className && typeof el.className === 'string') {
+            const classes = el.className.trim().split(/\\s+/).filter(c => c);
+            if (classes.length > 0) return `.${classes[0]}`;
+        }
+        return el.tagName.toLowerCase();
+    };
+    
+    // Zero-size boxes are rejected from the rect alone; computed style (a
+    // style recalc) is only read for elements that take up space
+    const isVisible = (el, rect) => {
+        if (rect.width <= 0 || rect.height <= 0) return false;
+        const style = window.getComputedStyle(el);
+        return style.visibility !== 'hidden' && 
+               style.display !== 'none' &&
+               style.opacity !== '0';
+    };
+    
+    // Dedup and cap in the page so only the kept elements cross CDP
+    const elements = [];
+    const seen = new Set();
+    const tags = ['a', 'button', 'input', 'select', 'textarea', 'nav', 'header', 'footer'];
+    
+    // One TreeWalker pass buckets candidates by tag (instead of a selector-engine
+    // pass per tag); they are then taken in tag order, as before
+    const buckets = new Map(tags.map(tag => [tag, []]));
+    const walker = document.createTreeWalker(document, NodeFilter.SHOW_ELEMENT);
+    for (let node = walker.nextNode(); node; node = walker.nextNode()) {
+        const bucket = buckets.get(node.localName);
+        if (bucket) bucket.push(node);
+    }
+    
+    for (const tag of tags) {
+        for (const el of buckets.get(tag)) {
+            if (elements.length >= """ + str(_MAX_PAGE_SELECTORS) + """) return elements;
+            const selector = getSelector(el);
+            const text = el.textContent?.trim().slice(0, 100) || '';
+            const key = `${selector}|${text.slice(0, 30)}`;
+            if (seen.has(key)) continue;
+            seen.add(key);
+            const rect = el.getBoundingClientRect();
+            // Compact record (see _expand_element); empty strings are left out
+            const rec = {
+                g: tag,
+                s: selector,
+                x: text,
+                v: isVisible(el, rect) ? 1 : 0,
+                rs: rect.y > window.innerHeight || rect.y < 0 ? 1 : 0
+            };
+            const type = el.type || el.getAttribute('type');
+            const name = el.name || el.getAttribute('name');
+            if (type) rec.ty = type;
+            if (name) rec.n = name;
+            if (el.id) rec.i = el.id;
+            elements.push(rec);
+        }
+    }
+    
+    return elements;
+}
+"""
+
+# Everything discovery needs from a loaded page in one CDP round trip
+_SNAPSHOT_JS = """
+() => ({
+    title: document.title,
+    html: document.documentElement.outerHTML,
+    elements: window.__uidaiDiscover(),
+    links: Array.from(document.querySelectorAll('a[href]'), a => a.getAttribute('href')).slice(0, 20)
+})
+"""
+
+# All discovery JS as one bundle, installed once per crawl context and compiled
+# with each page; the per-page evaluate below is then a single call
+_DISCOVERY_INIT_JS = (
+    "window.__uidaiDiscover = " + _INTERACTIVE_ELEMENTS_JS.strip() + ";\n"
+    "window.__uidaiSnapshot = " + _SNAPSHOT_JS.strip() + ";"
+)
+
+# null when the bundle is not installed (a page from outside _crawl_page)
+_PAGE_SNAPSHOT_JS = "() => typeof window.__uidaiSnapshot === 'function' ? window.__uidaiSnapshot() : null"
+
+def _snapshot_page(page) -> Dict[str, Any]:
+    """
+    Title, HTML, interactive elements and the first 20 link hrefs of a page.
+    Falls back to separate Playwright calls if the combined script fails.
+    """
+    try:
+        snapshot = page.evaluate(_PAGE_SNAPSHOT_JS)
+        if snapshot is not None:
+            return snapshot
+    except Exception as e:
+        log.warning(f"Page snapshot script failed, using separate calls: {e}")
+    return {"title": page.title(), "html": page.content(), "elements": None, "links": None}
+
+def _route_request(route):
+    if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+        route.abort()
+    else:
+        route.continue_()
+
+def _crawl_page(browser, run_id: str, base_url: str, current_url: str,
+                depth: int, level: int) -> Tuple[Dict[str, Any], List[str]]:
+    """Load one page and return its info plus same-site links for the next level"""
+    log.info(f"[{run_id}] Crawling: {current_url} (depth={depth})")
+    # Fresh context per page: the browser is shared across runs, cookies/storage are not
+    context = browser.new_context(**_CONTEXT_OPTIONS)
+    try:
+        context.route("**/*", _route_request)
+        context.add_init_script(_DISCOVERY_INIT_JS)
+        page = context.new_page()
+        # networkidle never settles on pages with analytics beacons; the DOM is
+        # all discovery reads, so wait only until links/forms/buttons exist
+        page.goto(current_url, wait_until="domcontentloaded", timeout=30000)
+        try:
+            page.wait_for_selector(_CONTENT_SELECTOR, state="attached", timeout=5000)
+        except PlaywrightTimeoutError:
+            pass  # page has none of them; snapshot what is there
+        
+        # One evaluate for title, HTML, elements and links
+        snapshot = _snapshot_page(page)
+        
+        # Extract page information
+        page_info = extract_page_info(page, current_url, run_id, snapshot)
+        
+        # Find links for next level
+        next_links = []
+        if depth < level:
+            hrefs = snapshot.get("links")
+            if hrefs is None:
+                hrefs = [link.get_attribute("href") for link in page.query_selector_all("a[href]")[:20]]
+            for href in hrefs:  # Limited to 20 links per page
+                if href and href.startswith(('http://', 'https://', '/')):
+                    if href.startswith('/'):
+                        href = urljoin(base_url, href)
+                    if href.startswith(base_url):  # Same domain only
+                        next_links.append(href)
+        return page_info, next_links
+    finally:
+        context.close()
+
+def _crawl_worker(tasks: "queue.Queue"):
+    """Serve crawl tasks from `tasks` with a browser owned by this thread"""
+    try:
+        with sync_playwright() as p:
+            browser = None
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+                run_id, base_url, current_url, depth, level, future = task
+                if not future.set_running_or_notify_cancel():
+                    continue  # caller gave up on this page
+                try:
+                    # Launched on first use and again only if Chromium went away
+                    if browser is None or not browser.is_connected():
+                        browser = p.chromium.launch(headless=True)
+                    future.set_result(_crawl_page(browser, run_id, base_url, current_url, depth, level))
+                except Exception as e:
+                    future.set_exception(e)
+            if browser is not None:
+                browser.close()
+    except Exception as e:
+        # Playwright failed to start: fail whatever this worker picks up
+        log.warning(f"Discovery browser worker failed: {e}")
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            if task[-1].set_running_or_notify_cancel():
+                task[-1].set_exception(e)
+
+def _start_workers(tasks: "queue.Queue", count: int) -> List[threading.Thread]:
+    workers = [
+        threading.Thread(target=_crawl_worker, args=(tasks,), daemon=True, name=f"discovery-browser-{i}")
+        for i in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers
+
+def _stop_workers(tasks: "queue.Queue", workers: List[threading.Thread], timeout: float = None):
+    for _ in workers:
+        tasks.put(None)
+    for worker in workers:
+        worker.join(timeout)
+
+def _shared_pool() -> Tuple["queue.Queue", int]:
+    """Process-wide browser workers, started on first use and closed at exit"""
+    global _pool_tasks
+    with _pool_lock:
+        if _pool_tasks is None:
+            _pool_tasks = queue.Queue()
+            _pool_workers.extend(_start_workers(_pool_tasks, max(1, DISCOVERY_BROWSER_WORKERS)))
+            atexit.register(_shutdown_pool)
+        return _pool_tasks, len(_pool_workers)
+
+def _shutdown_pool():
+    """Close the shared browsers; registered with atexit by _shared_pool()"""
+    global _pool_tasks
+    with _pool_lock:
+        tasks, workers = _pool_tasks, list(_pool_workers)
+        _pool_tasks = None
+        _pool_workers.clear()
+    if tasks is not None:
+        _stop_workers(tasks, workers, timeout=10)
+
+def discover_with_selectors(run_id: str, url: str, level: int = 1, max_pages: int = 10,
+                            isolate: bool = False) -> Dict[str, Any]:
     """
     Enhanced discovery that extracts real selectors and visibility info
-    Python 3.13 compatible - uses html.parser instead of lxml
+    
+    Pages are crawled by the shared, long-lived browser workers; isolate=True
+    launches dedicated browsers for this call and closes them afterwards.
     """
     log.info(f"[{run_id}] Starting enhanced discovery for {url}")
     
     discovered_pages = []
-    urls_to_visit = [(url, 0)]  # (url, depth)
+    urls_to_visit = deque([(url, 0)])  # (url, depth)
     visited_urls = set()
     
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context(
-            viewport={'width': 1920, 'height': 1080},
-            user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-        )
-        
-        while urls_to_visit and len(discovered_pages) < max_pages:
-            current_url, depth = urls_to_visit.pop(0)
-            
-            if current_url in visited_urls or depth > level:
-                continue
+    if isolate:
+        tasks: "queue.Queue" = queue.Queue()
+        workers = _start_workers(tasks, max(1, min(DISCOVERY_BROWSER_WORKERS, max_pages)))
+        slots = len(workers)
+    else:
+        tasks, slots = _shared_pool()
+        workers = []
+    
+    in_flight: Dict[Future, Tuple[str, int]] = {}
+    try:
+        while True:
+            # Keep every browser busy, in crawl order, within the remaining page budget
+            while (urls_to_visit and len(in_flight) < slots
+                   and len(discovered_pages) + len(in_flight) < max_pages):
+                current_url, depth = urls_to_visit.popleft()
+                if current_url in visited_urls or depth > level:
+                    continue
+                visited_urls.add(current_url)
+                future = Future()
+                tasks.put((run_id, url, current_url, depth, level, future))
+                in_flight[future] = (current_url, depth)
             
-            visited_urls.add(current_url)
+            if not in_flight:
+                break
             
-            try:
-                log.info(f"[{run_id}] Crawling: {current_url} (depth={depth})")
-                page = context.new_page()
-                page.goto(current_url, wait_until="networkidle", timeout=30000)
-                
-                # Extract page information
-                page_info = extract_page_info(page, current_url, run_id)
+            # Refill as soon as any page finishes instead of waiting for a whole round
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                current_url, depth = in_flight.pop(future)
+                try:
+                    page_info, next_links = future.result()
+                except Exception as e:
+                    log.warning(f"[{run_id}] Failed to crawl {current_url}: {e}")
+                    continue
                 discovered_pages.append(page_info)
-                
-                # Find links for next level
-                if depth < level:
-                    links = page.query_selector_all("a[href]")
-                    for link in links[:20]:  # Limit to 20 links per page
-                        href = link.get_attribute("href")
-                        if href and href.startswith(('http://', 'https://', '/')):
-                            if href.startswith('/'):
-                                from urllib.parse import urljoin
-                                href = urljoin(url, href)
-                            if href.startswith(url):  # Same domain only
-                                urls_to_visit.append((href, depth + 1))
-                
-                page.close()
-                
-            except Exception as e:
-                log.warning(f"[{run_id}] Failed to crawl {current_url}: {e}")
-                continue
-        
-        browser.close()
+                urls_to_visit.extend((href, depth + 1) for href in next_links)
+    finally:
+        # Pages still queued (only on error) are dropped rather than crawled
+        for future in in_flight:
+            future.cancel()
+        if workers:
+            _stop_workers(tasks, workers)
     
     log.info(f"[{run_id}] Discovery complete: {len(discovered_pages)} pages found")
     
@@ -74,213 +333,332 @@ def discover_with_selectors(run_id: str, url: str, level: int = 1, max_pages: in
         "metadata": {
             "total_pages": len(discovered_pages),
             "urls_visited": list(visited_urls),
-            "parser": "html.parser"  # Note: Using html.parser for Python 3.13
+            "parser": HTML_PARSER
         }
     }
 
-def extract_page_info(page, url: str, run_id: str) -> Dict[str, Any]:
+def extract_page_info(page, url: str, run_id: str, snapshot: Dict[str, Any] = None) -> Dict[str, Any]:
     """
     Extract comprehensive page information including real selectors
-    Python 3.13 compatible - uses html.parser
     """
     # Get basic info
-    title = page.title()
-    html = page.content()
-    
-    # Parse HTML with html.parser (Python 3.13 compatible)
-    # Changed from: soup = BeautifulSoup(html, 'lxml')
-    soup = BeautifulSoup(html, 'html.parser')
+    if snapshot is None:
+        snapshot = _snapshot_page(page)
+    title = snapshot["title"]
     
-    # Extract interactive elements with real selectors
-    interactive_elements = extract_interactive_elements(page, soup)
+    # Interactive elements with real selectors come from the browser; the
+    # soup-based selectors are only needed when that script failed
+    elements = snapshot.get("elements")
+    if elements is None:
+        elements = _evaluate_elements(page)
     
-    # Extract navigation elements
-    navigation = extract_navigation(soup)
+    # Taken out of the snapshot so the page's str is freed once handed off
+    parsed = _parse_page(snapshot.pop("html"), with_selectors=elements is None)
     
-    # Extract forms
-    forms = extract_forms(soup)
+    if elements is not None:
+        interactive_elements = [_expand_element(rec) for rec in elements]
+    else:
+        interactive_elements = parsed["simple_selectors"]
     
-    # Get page structure
-    structure = {
-        "has_header": bool(soup.find(['header', 'div.header', 'div#header'])),
-        "has_footer": bool(soup.find(['footer', 'div.footer', 'div#footer'])),
-        "has_nav": bool(soup.find(['nav', 'div.nav', 'ul.menu'])),
-        "has_search": bool(soup.find('input', type='search') or soup.find('input', attrs={'name': lambda x: x and 'search' in x.lower()})),
-    }
+    counts = parsed["counts"]
     
     log.info(f"[{run_id}] Extracted {len(interactive_elements)} interactive elements from {url}")
     
     return {
         "url": url,
         "title": title,
-        "selectors": interactive_elements[:50],  # Top 50 elements
-        "navigation": navigation,
-        "forms": forms,
-        "structure": structure,
+        "selectors": interactive_elements[:_MAX_PAGE_SELECTORS],  # Top 50 elements
+        "navigation": parsed["navigation"],
+        "forms": parsed["forms"],
+        "structure": parsed["structure"],
         "metadata": {
-            "links_count": len(soup.find_all('a')),
-            "buttons_count": len(soup.find_all('button')),
-            "inputs_count": len(soup.find_all('input')),
-            "images_count": len(soup.find_all('img')),
-            "parser": "html.parser"
+            "links_count": counts["a"],
+            "buttons_count": counts["button"],
+            "inputs_count": counts["input"],
+            "images_count": counts["img"],
+            "parser": HTML_PARSER
         }
     }
 
-def extract_interactive_elements(page, soup: BeautifulSoup) -> List[Dict[str, Any]]:
+def _parse_and_extract(markup: str, with_selectors: bool) -> Dict[str, Any]:
     """
-    Extract interactive elements with visibility and position info
+    Parse page HTML and run the soup-based extractors; returns plain dicts only,
+    so it can run in a parse worker process
     """
-    elements = []
+    # lxml when available, html.parser otherwise
+    # Only tags the extractors read (and their subtrees) become soup objects
+    if HTML_PARSER == "lxml":
+        # libxml2 parses UTF-8 bytes natively: encode once, drop the str and tell
+        # bs4 the encoding so it skips detection
+        markup = markup.encode("utf-8", "replace")
+        soup = BeautifulSoup(markup, HTML_PARSER, parse_only=_PAGE_STRAINER, from_encoding="utf-8")
+    else:
+        soup = BeautifulSoup(markup, HTML_PARSER, parse_only=_PAGE_STRAINER)
+    del markup
     
-    # Execute JavaScript to get visibility info
-    js_code = """
-    () => {
-        const getSelector = (el) => {
-            if (el.id) return `#${el.id}`;
-            if (el.className && typeof el.className === 'string') {
-                const classes = el.className.trim().split(/\\s+/).filter(c => c);
-                if (classes.length > 0) return `.${classes[0]}`;
-            }
-            return el.tagName.toLowerCase();
-        };
-        
-        const isVisible = (el) => {
-            const rect = el.getBoundingClientRect();
-            const style = window.getComputedStyle(el);
-            return rect.width > 0 && rect.height > 0 && 
-                   style.visibility !== 'hidden' && 
-                   style.display !== 'none' &&
-                   style.opacity !== '0';
-        };
-        
-        const elements = [];
-        const tags = ['a', 'button', 'input', 'select', 'textarea', 'nav', 'header', 'footer'];
-        
-        tags.forEach(tag => {
-            document.querySelectorAll(tag).forEach(el => {
-                const rect = el.getBoundingClientRect();
-                const selector = getSelector(el);
-                elements.push({
-                    tag: el.tagName.toLowerCase(),
-                    selector: selector,
-                    text: el.textContent?.trim().slice(0, 100) || '',
-                    visible: isVisible(el),
-                    position: {
-                        x: Math.round(rect.x),
-                        y: Math.round(rect.y),
-                        width: Math.round(rect.width),
-                        height: Math.round(rect.height)
-                    },
-                    requires_scroll: rect.y > window.innerHeight || rect.y < 0,
-                    type: el.type || el.getAttribute('type') || '',
-                    name: el.name || el.getAttribute('name') || '',
-                    id: el.id || '',
-                    classes: el.className || ''
-                });
-            });
-        });
-        
-        return elements;
+    # One walk over the DOM collects counts, structure flags, nav containers,
+    # forms and the controls used by the fallback selector extraction
+    scan = _scan_page(soup)
+    
+    return {
+        "counts": scan["counts"],
+        "structure": scan["structure"],
+        "navigation": extract_navigation(soup, scan["nav_elements"]),
+        "forms": extract_forms(soup, scan["forms"]),
+        "simple_selectors": extract_simple_selectors(soup, scan["controls"]) if with_selectors else None,
     }
+
+def _parse_worker_ready(_=None) -> bool:
+    """No-op run once per new pool, so spawn start-up and the bs4/lxml imports
+    happen before any page's parse timeout starts"""
+    return True
+
+def _get_parse_pool() -> Pool:
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # spawn: never fork a process that has Playwright threads running.
+            # multiprocessing's Pool (not ProcessPoolExecutor) so a stuck
+            # worker can be killed with terminate()
+            pool = multiprocessing.get_context("spawn").Pool(processes=DISCOVERY_PARSE_WORKERS)
+            pool.map(_parse_worker_ready, range(DISCOVERY_PARSE_WORKERS), chunksize=1)
+            _parse_pool = pool
+        return _parse_pool
+
+def _discard_parse_pool(pool: Pool):
+    """Kill `pool`'s workers (a timed-out parse included); the next parse starts a fresh pool"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool = None
+    pool.terminate()
+
+def _shutdown_parse_pool():
+    """Kill the parse workers at interpreter exit"""
+    pool = _parse_pool
+    if pool is not None:
+        _discard_parse_pool(pool)
+
+atexit.register(_shutdown_parse_pool)
+
+def _parse_page(markup: str, with_selectors: bool) -> Dict[str, Any]:
     """
+    _parse_and_extract in a parse worker process with DISCOVERY_PARSE_TIMEOUT,
+    so pathological HTML cannot stall a crawl thread or hold the GIL;
+    in-process when DISCOVERY_PARSE_WORKERS=0
+    """
+    if DISCOVERY_PARSE_WORKERS <= 0:
+        return _parse_and_extract(markup, with_selectors)
     
-    try:
-        elements = page.evaluate(js_code)
-        # Filter out duplicates and sort by importance
-        seen = set()
-        unique_elements = []
-        
-        for elem in elements:
-            key = (elem['selector'], elem['text'][:30])
-            if key not in seen:
-                seen.add(key)
-                unique_elements.append(elem)
-        
-        return unique_elements
+    for attempt in range(2):
+        pool = _get_parse_pool()
+        try:
+            result = pool.apply_async(_parse_and_extract, (markup, with_selectors))
+        except ValueError:  # "Pool not running": retired by another thread just now
+            continue
+        try:
+            return result.get(timeout=DISCOVERY_PARSE_TIMEOUT)
+        except multiprocessing.TimeoutError:
+            with _parse_pool_lock:
+                retired = _parse_pool is not pool
+            if retired and attempt == 0:
+                # another page's timeout killed the pool under this parse;
+                # it was not this page's fault, so run it once on the new pool
+                continue
+            # terminate() kills the stuck worker so it stops burning CPU/memory
+            _discard_parse_pool(pool)
+            raise TimeoutError(f"HTML parsing took longer than {DISCOVERY_PARSE_TIMEOUT}s")
+    raise TimeoutError("HTML parse pool kept being restarted")
+
+# 'navigation' already contains 'nav'; compiled once, matched in C per class
+_NAV_CLASS_RE = re.compile(r'nav|menu', re.I)
+_SEARCH_RE = re.compile(r'search', re.I)
+# Only these tags feed _scan_page; everything else is skipped by the matcher
+_SCAN_TAGS = ['a', 'button', 'input', 'img', 'form', 'nav', 'header', 'footer', 'div']
+_KEEP_TAGS = frozenset(['a', 'button', 'input', 'select', 'textarea', 'img',
+                        'form', 'nav', 'header', 'footer'])
+
+def _is_nav_class(classes) -> bool:
+    if isinstance(classes, str):
+        classes = classes.split()
+    return bool(classes) and any(_NAV_CLASS_RE.search(c) for c in classes)
+
+# Extractor tags plus every div: a plain tag-name list, because how a callable
+# strainer is called differs across bs4 releases (from 4.13 it gets no attrs).
+# Which divs are nav-like is decided by _scan_page
+_PAGE_STRAINER = SoupStrainer(sorted(_KEEP_TAGS | {'div'}))
+
+def _scan_page(soup: BeautifulSoup) -> Dict[str, Any]:
+    """
+    Single pass over all tags, replacing a separate find/find_all walk per
+    count, structure flag, navigation container and form
+    """
+    counts = {"a": 0, "button": 0, "input": 0, "img": 0}
+    structure = {"has_header": False, "has_footer": False, "has_nav": False, "has_search": False}
+    navs, nav_divs, forms = [], [], []
+    controls = []  # a/button/input in document order, for extract_simple_selectors
+    
+    for tag in soup.find_all(_SCAN_TAGS):
+        name = tag.name
+        if name in counts:
+            counts[name] += 1
+            if name != 'img':
+                controls.append(tag)
         
+        if name == 'input':
+            if not structure["has_search"]:
+                attrs = tag.attrs
+                field_name = attrs.get('name')
+                if attrs.get('type') == 'search' or (field_name and _SEARCH_RE.search(field_name)):
+                    structure["has_search"] = True
+        elif name == 'nav':
+            structure["has_nav"] = True
+            navs.append(tag)
+        elif name == 'div':
+            if _is_nav_class(tag.attrs.get('class')):
+                nav_divs.append(tag)
+        elif name == 'form':
+            forms.append(tag)
+        elif name == 'header':
+            structure["has_header"] = True
+        elif name == 'footer':
+            structure["has_footer"] = True
+    
+    return {
+        "counts": counts,
+        "structure": structure,
+        "nav_elements": navs + nav_divs,  # <nav> first, then nav-like divs
+        "forms": forms,
+        "controls": controls,
+    }
+
+def _expand_element(rec: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact record from _INTERACTIVE_ELEMENTS_JS -> the element dict stored per page"""
+    return {
+        "tag": rec["g"],
+        "selector": rec["s"],
+        "text": rec["x"],
+        "visible": bool(rec["v"]),
+        "requires_scroll": bool(rec["rs"]),
+        "type": rec.get("ty", ""),
+        "name": rec.get("n", ""),
+        "id": rec.get("i", ""),
+    }
+
+def _evaluate_elements(page) -> List[Dict[str, Any]] | None:
+    """Run the element-collection script on `page`; None if it fails"""
+    try:
+        # Execute JavaScript to get visibility info
+        return page.evaluate(_INTERACTIVE_ELEMENTS_JS)
     except Exception as e:
         log.warning(f"Failed to extract elements with JS: {e}")
+        return None
+
+def extract_interactive_elements(page, soup: BeautifulSoup, elements: List[Dict[str, Any]] = None,
+                                 controls: List = None) -> List[Dict[str, Any]]:
+    """
+    Extract interactive elements with visibility and position info
+    Pass `elements` already collected by _snapshot_page to skip the evaluate call,
+    and `controls` from _scan_page so the fallback does not walk the soup again
+    """
+    if elements is None:
+        elements = _evaluate_elements(page)
+    if elements is None:
         # Fallback to simple extraction
-        return extract_simple_selectors(soup)
+        return extract_simple_selectors(soup, controls)
+    # Already deduplicated (selector + first 30 chars of text) and capped in the page
+    return [_expand_element(rec) for rec in elements]
 
-def extract_simple_selectors(soup: BeautifulSoup) -> List[Dict[str, Any]]:
+def extract_simple_selectors(soup: BeautifulSoup, controls: List = None) -> List[Dict[str, Any]]:
     """
     Fallback: Simple selector extraction without visibility info
-    Works with html.parser
+    One walk over a/button/input (or the `controls` _scan_page already bucketed);
+    output keeps links, then buttons, then inputs
     """
-    elements = []
-    
-    # Links
-    for link in soup.find_all('a', href=True):
-        selector = f"a[href='{link['href']}']" if link.get('href') else 'a'
-        elements.append({
-            'tag': 'a',
-            'selector': selector,
-            'text': link.get_text(strip=True)[:100],
-            'visible': True,  # Assume visible
-            'type': 'link'
-        })
+    links, buttons, inputs = [], [], []
     
-    # Buttons
-    for button in soup.find_all('button'):
-        selector = f"#{button.get('id')}" if button.get('id') else 'button'
-        elements.append({
-            'tag': 'button',
-            'selector': selector,
-            'text': button.get_text(strip=True)[:100],
-            'visible': True,
-            'type': 'button'
-        })
+    if controls is None:
+        controls = soup.find_all(['a', 'button', 'input'])
     
-    # Inputs
-    for input_elem in soup.find_all('input'):
-        selector = f"input[name='{input_elem.get('name')}']" if input_elem.get('name') else 'input'
-        elements.append({
-            'tag': 'input',
-            'selector': selector,
-            'type': input_elem.get('type', 'text'),
-            'name': input_elem.get('name', ''),
-            'visible': True
-        })
+    for elem in controls:
+        name = elem.name
+        attrs = elem.attrs
+        if name == 'a':
+            href = attrs.get('href')
+            if href is None:
+                continue
+            links.append({
+                'tag': 'a',
+                'selector': f"a[href='{href}']" if href else 'a',
+                'text': elem.get_text(strip=True)[:100],
+                'visible': True,  # Assume visible
+                'type': 'link'
+            })
+        elif name == 'button':
+            button_id = attrs.get('id')
+            buttons.append({
+                'tag': 'button',
+                'selector': f"#{button_id}" if button_id else 'button',
+                'text': elem.get_text(strip=True)[:100],
+                'visible': True,
+                'type': 'button'
+            })
+        else:
+            input_name = attrs.get('name')
+            inputs.append({
+                'tag': 'input',
+                'selector': f"input[name='{input_name}']" if input_name else 'input',
+                'type': attrs.get('type', 'text'),
+                'name': attrs.get('name', ''),
+                'visible': True
+            })
     
-    return elements
+    return links + buttons + inputs
 
-def extract_navigation(soup: BeautifulSoup) -> List[Dict[str, str]]:
-    """Extract navigation links - html.parser compatible"""
-    nav_elements = soup.find_all(['nav']) or []
-    
-    # Also look for common navigation class names
-    nav_elements.extend(soup.find_all('div', class_=lambda x: x and any(nav_class in x.lower() for nav_class in ['nav', 'menu', 'navigation'])))
+def extract_navigation(soup: BeautifulSoup, nav_elements: List = None) -> List[Dict[str, str]]:
+    """Extract navigation links; pass nav_elements from _scan_page to skip the lookup"""
+    if nav_elements is None:
+        nav_elements = soup.find_all(['nav']) or []
+        
+        # Also look for common navigation class names
+        nav_elements.extend(soup.find_all('div', class_=_NAV_CLASS_RE))
     
     nav_links = []
     
     for nav in nav_elements:
         for link in nav.find_all('a', href=True):
+            href = link.attrs['href']
             nav_links.append({
                 'text': link.get_text(strip=True),
-                'href': link['href'],
-                'selector': f"nav a[href='{link['href']}']"
+                'href': href,
+                'selector': f"nav a[href='{href}']"
             })
     
     return nav_links[:20]  # Top 20 nav links
 
-def extract_forms(soup: BeautifulSoup) -> List[Dict[str, Any]]:
-    """Extract form information - html.parser compatible"""
+def extract_forms(soup: BeautifulSoup, form_elements: List = None) -> List[Dict[str, Any]]:
+    """Extract form information; pass form_elements from _scan_page to skip the lookup"""
     forms = []
     
-    for form in soup.find_all('form'):
+    if form_elements is None:
+        form_elements = soup.find_all('form')
+    
+    for form in form_elements:
+        form_attrs = form.attrs
         form_info = {
-            'action': form.get('action', ''),
-            'method': form.get('method', 'get').upper(),
+            'action': form_attrs.get('action', ''),
+            'method': form_attrs.get('method', 'get').upper(),
             'inputs': []
         }
         
         for input_elem in form.find_all(['input', 'select', 'textarea']):
+            # plain dict lookups on .attrs instead of a Tag method call per attribute
+            attrs = input_elem.attrs
             form_info['inputs'].append({
-                'type': input_elem.get('type', 'text'),
-                'name': input_elem.get('name', ''),
-                'id': input_elem.get('id', ''),
-                'required': input_elem.has_attr('required')
+                'type': attrs.get('type', 'text'),
+                'name': attrs.get('name', ''),
+                'id': attrs.get('id', ''),
+                'required': 'required' in attrs
             })
         
         forms.append(form_info)
@@ -8,14 +8,34 @@ import json
 import logging
 import uuid
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+from types import MappingProxyType
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable, Iterator
 from .ollama_client import generate_with_model
+from . import llm_cache
 import os
+
+try:
+    import orjson
+except ImportError:  # optional - stdlib json parses LLM responses without it
+    orjson = None
+
 log = logging.getLogger(__name__)
 
+# JSON parser for LLM responses
+_loads = orjson.loads if orjson is not None else json.loads
+
+# Models generating at once against the single Ollama host; each one has to be
+# loaded into memory, and a losing request keeps the GPU busy until it finishes
+GENERATOR_MODEL_CONCURRENCY = max(1, int(os.getenv("GENERATOR_MODEL_CONCURRENCY", "2")))
+
+# Characters not allowed in generated test function/file names
+_SAFE_NAME_RE = re.compile(r'[^a-z0-9_]')
+
 # UIDAI Scenario Templates (matching UI - RunCreator.jsx)
-SCENARIO_TEMPLATES = {
+_SCENARIO_TEMPLATE_DEFS = {
     "uidai-homepage-navigation": {
         "id": "uidai-homepage-navigation",
         "name": "1. UIDAI Homepage & Main Navigation",
@@ -128,6 +148,20 @@ SCENARIO_TEMPLATES = {
     }
 }
 
+# Read-only view with tuple fields: templates are shared process-wide and their
+# prompt blocks are precomputed below, so they must not change after import.
+# Values stay plain dicts so API responses and stored results serialize as before.
+SCENARIO_TEMPLATES = MappingProxyType({
+    key: {field: tuple(value) if isinstance(value, list) else value
+          for field, value in template.items()}
+    for key, template in _SCENARIO_TEMPLATE_DEFS.items()
+})
+
+# Lowercased preambles models put before the code, stripped in this order
+_AI_PREFIXES = ("here's the code:", "here is", "```python", "python")
+# Line starts that mark the beginning of the actual test code
+_CODE_START = ('import ', 'from ', 'async def', '@pytest')
+
 def clean_generated_code(raw_code: str) -> str:
     """Aggressively clean generated code from various formats"""
     if not isinstance(raw_code, str):
@@ -135,100 +169,186 @@ def clean_generated_code(raw_code: str) -> str:
     
     code = raw_code.strip()
     
+    # Already clean: starts at the code and has no fences, so none of the passes below apply
+    if code.startswith(_CODE_START) and "```" not in code:
+        return code
+    
     # Remove markdown code blocks
-    if "```python" in code:
-        parts = code.split("```python")
-        if len(parts) > 1:
-            code = parts[1].split("```")[0]
-    elif "```" in code:
-        parts = code.split("```")
-        if len(parts) >= 3:
-            code = parts[1]
+    # (find + slice: only the fenced body is copied)
+    start = code.find("```python")
+    if start != -1:
+        start += len("```python")
+        end = code.find("```", start)
+        code = code[start:] if end == -1 else code[start:end]
+    else:
+        start = code.find("```")
+        end = code.find("```", start + 3) if start != -1 else -1
+        if end != -1:
+            code = code[start + 3:end]
     
-    # Remove common AI prefixes
-    prefixes = ["Here's the code:", "Here is", "```python", "python"]
-    for prefix in prefixes:
-        if code.lower().startswith(prefix.lower()):
+    # Remove common AI prefixes (only the head of the code is lowercased)
+    for prefix in _AI_PREFIXES:
+        if code[:len(prefix)].lower() == prefix:
             code = code[len(prefix):].strip()
     
     # Find first import or async def
     lines = code.split('\n')
     for i, line in enumerate(lines):
-        if line.strip().startswith(('import ', 'from ', 'async def', '@pytest')):
+        if line.strip().startswith(_CODE_START):
             code = '\n'.join(lines[i:])
             break
     
     return code.strip()
 
+# Tokens every generated test must contain (case-insensitive), by regex group
+_REQUIRED_TOKENS = {"playwright": "playwright", "test": "async def test_", "page": "await page."}
+_REQUIRED_RE = re.compile(r"(?P<playwright>playwright)|(?P<test>async def test_)|(?P<page>await page\.)", re.IGNORECASE)
+
+def _missing_required_tokens(code: str) -> List[str]:
+    """Required tokens absent from code; one scan, stopping once all are seen"""
+    seen = set()
+    for m in _REQUIRED_RE.finditer(code):
+        seen.add(m.lastgroup)
+        if len(seen) == len(_REQUIRED_TOKENS):
+            return []
+    return [token for group, token in _REQUIRED_TOKENS.items() if group not in seen]
+
 def validate_test_code(code: str) -> bool:
     """Validate generated code looks like valid Playwright test"""
     if not code or len(code) < 100:
         return False
     
-    required = ['playwright', 'async def test_', 'await page.']
-    for pattern in required:
-        if pattern.lower() not in code.lower():
-            log.warning(f"Missing: {pattern}")
-            return False
+    missing = _missing_required_tokens(code)
+    if missing:
+        log.warning(f"Missing: {', '.join(missing)}")
+        return False
     
     return True
+
+def cached_generate(model: str, payload: Any = None, use_cache: bool = True,
+                    keep: Callable[[Any], bool] = None, **kwargs):
+    """
+    generate_with_model() memoized on disk by a SHA-256 of the canonical prompt.
+    Only non-empty results for which keep(result) is true are stored, so a bad
+    generation is retried on the next run instead of being replayed.
+    """
+    if not (use_cache and llm_cache.enabled()):
+        return generate_with_model(model, payload, **kwargs)
+    
+    # the payload-as-kwargs form (url=..., pages=...) is keyed the same way
+    key = llm_cache.key(model, payload if payload is not None else
+                        {k: v for k, v in kwargs.items() if k not in ("format", "timeout")},
+                        {"format": kwargs.get("format", "")})
+    cached = llm_cache.get(key)
+    if cached is not None:
+        log.info(f"LLM cache hit for {model} ({key[:12]})")
+        return cached
+    
+    result = generate_with_model(model, payload, **kwargs)
+    
+    if result and (keep is None or keep(result)):
+        llm_cache.put(key, result)
+    return result
+
+def _is_valid_generated_code(code: Any) -> bool:
+    return isinstance(code, str) and validate_test_code(clean_generated_code(code))
+
 def get_scenario_by_id(scenario_id: str) -> Optional[Dict[str, Any]]:
     """Get scenario template by ID"""
     return SCENARIO_TEMPLATES.get(scenario_id)
 
 
+def _keywords_re(keywords: List[str]) -> "re.Pattern":
+    # zero-width lookahead: every match position is tried, so overlapping
+    # keywords are all reported, like independent `in` checks
+    return re.compile("(?=(" + "|".join(map(re.escape, keywords)) + "))")
+
+# Keywords detect_uidai_scenario looks for in page URLs / selector text
+_URL_KEYWORDS_RE = _keywords_re(["my-aadhaar", "about", "locate", "faq", "download"])
+_TEXT_KEYWORDS_RE = _keywords_re(["download", "update", "vision", "mission", "enrolment",
+                                  "center", "help", "form", "pdf"])
+
+_DETECT_TEXT_CAP = 1 << 20
+
 def detect_uidai_scenario(pages: List[Dict]) -> str:
     """
     Detect most appropriate UIDAI scenario based on discovered pages
     For UIDAI, we analyze URLs and content
     """
-    all_urls = " ".join([page.get("url", "") for page in pages]).lower()
-    all_text = " ".join([
-        " ".join([sel.get("text", "") for sel in page.get("selectors", [])])
-        for page in pages
-    ]).lower()
+    all_urls = " ".join(page.get("url", "") for page in pages).lower()
+    # The first MiB of selector text carries enough signal; skip lowercasing the rest
+    all_text = " ".join(
+        sel.get("text", "") for page in pages for sel in page.get("selectors", ())
+    )[:_DETECT_TEXT_CAP].lower()
+    
+    # One scan per haystack reports every keyword present (overlaps included),
+    # instead of a separate substring scan per keyword
+    url_hits = set(_URL_KEYWORDS_RE.findall(all_urls))
+    text_hits = set(_TEXT_KEYWORDS_RE.findall(all_text))
     
     # Detection based on URL patterns and content
-    if "my-aadhaar" in all_urls or "download" in all_text or "update" in all_text:
+    if "my-aadhaar" in url_hits or "download" in text_hits or "update" in text_hits:
         return "uidai-my-aadhaar-services"
-    elif "about" in all_urls or "vision" in all_text or "mission" in all_text:
+    elif "about" in url_hits or "vision" in text_hits or "mission" in text_hits:
         return "uidai-about-contact"
-    elif "locate" in all_urls or "enrolment" in all_text or "center" in all_text:
+    elif "locate" in url_hits or "enrolment" in text_hits or "center" in text_hits:
         return "uidai-enrolment-centers"
-    elif "faq" in all_urls or "help" in all_text:
+    elif "faq" in url_hits or "help" in text_hits:
         return "uidai-faqs-help"
-    elif "download" in all_urls or "form" in all_text or "pdf" in all_text:
+    elif "download" in url_hits or "form" in text_hits or "pdf" in text_hits:
         return "uidai-downloads-resources"
     else:
         # Default to homepage navigation
         return "uidai-homepage-navigation"
 
 
+# Serialized discovery context allowed in one prompt (bytes of JSON)
+_PROMPT_CONTEXT_BUDGET = 8192
+
+def _unique_pages(pages: List[Dict]) -> Iterator[Dict]:
+    """Pages in order, skipping any whose url was already seen (lazy)"""
+    seen = set()
+    for page in pages:
+        page_url = page.get("url")
+        if page_url not in seen:
+            seen.add(page_url)
+            yield page
+
+def _summarize_pages(pages: List[Dict], max_pages: int, max_sels: int, text_cap: int) -> tuple:
+    """
+    Compact, hashable view of discovery pages shared by the prompt builders:
+    ((url, title, ((selector, text), ...)), ...) - pairs serialize as JSON arrays
+    """
+    return tuple(
+        (page.get("url", ""), page.get("title", ""), tuple(
+            (sel.get("selector", "")[:80], sel.get("text", "")[:text_cap])
+            for sel in page.get("selectors", ())[:max_sels]
+        ))
+        for page in islice(_unique_pages(pages), max_pages)
+    )
+
+def _fit_prompt_budget(items: list, budget: int = _PROMPT_CONTEXT_BUDGET) -> list:
+    """Halve `items` (keeping the first ones) until their JSON fits in budget"""
+    while len(items) > 1 and len(json.dumps(items)) > budget:
+        items = items[:len(items) // 2]
+    return items
+
 def create_scenario_from_discovery_ai(
     pages: List[Dict],
     url: str,
-    model: str = "mistral:latest"
+    model: str = "mistral:latest",
+    use_cache: bool = True
 ) -> Dict[str, Any]:
     """
     Use AI to create custom test scenario from discovered pages
     Fallback to template detection if AI fails
     """
     # Prepare discovery data for AI
-    discovered_data = []
-    for page in pages[:5]:  # Top 5 pages
-        selectors_summary = []
-        for sel in page.get("selectors", [])[:10]:  # Top 10 elements per page
-            sel_info = {
-                "selector": sel.get("selector", ""),
-                "text": sel.get("text", "")[:50]  # First 50 chars
-            }
-            selectors_summary.append(sel_info)
-        
-        discovered_data.append({
-            "url": page.get("url"),
-            "title": page.get("title", ""),
-            "elements": selectors_summary
-        })
+    # Top 5 pages, top 10 elements per page as [selector, text] pairs
+    discovered_data = _fit_prompt_budget([
+        {"url": page_url, "title": title, "elements": elements}
+        for page_url, title, elements in _summarize_pages(pages, 5, 10, 50)
+    ])
     
     prompt = {
         "instruction": """You are a test scenario creator for government websites. 
@@ -258,7 +378,9 @@ Keep it practical and achievable.""",
     
     try:
         log.info(f"Generating scenario with AI model: {model}")
-        result = generate_with_model(model, prompt, format="json", timeout=60)
+        result = cached_generate(model, prompt, use_cache=use_cache,
+                                 keep=lambda r: isinstance(r, dict) and "name" in r,
+                                 format="json", timeout=60)
         
         if isinstance(result, dict) and "name" in result:
             log.info(f"✓ AI generated scenario: {result.get('name')}")
@@ -270,7 +392,7 @@ Keep it practical and achievable.""",
             }
         elif isinstance(result, str):
             # Try to parse string response
-            parsed = json.loads(result)
+            parsed = _loads(result)
             if "name" in parsed:
                 return {
                     "ok": True,
@@ -296,22 +418,17 @@ def generate_playwright_test_code(
     scenario: Dict[str, Any],
     pages: List[Dict],
     url: str,
-    model: str = "mistral:latest"
+    model: str = "mistral:latest",
+    use_cache: bool = True
 ) -> str:
     """
     Generate Playwright test code using AI based on scenario and discovered elements
     """
     # Prepare context for AI
-    elements_by_page = {}
-    for page in pages[:3]:  # Top 3 pages
-        page_url = page.get("url", "")
-        elements_by_page[page_url] = [
-            {
-                "selector": s.get("selector", ""),
-                "text": s.get("text", "")[:30]
-            }
-            for s in page.get("selectors", [])[:15]  # Top 15 elements
-        ]
+    # Top 3 pages, top 15 elements each
+    elements_by_page = dict(_fit_prompt_budget([
+        (page_url, elements) for page_url, _, elements in _summarize_pages(pages, 3, 15, 30)
+    ]))
     
     prompt = {
         "instruction": """You are an expert Playwright test code generator for Python.
@@ -368,18 +485,10 @@ Return ONLY the Python code. No explanations, no markdown blocks.""",
     
     try:
         log.info(f"Generating test code with {model}")
-        code = generate_with_model(model, prompt, format="", timeout=90)
-        
-        if not isinstance(code, str):
-            code = str(code)
-        
-        # Clean up markdown code blocks if present
-        code = code.strip()
-        if "```python" in code:
-            code = code.split("```python")[1].split("```")[0]
-        elif "```" in code:
-            code = code.split("```")[1].split("```")[0]
+        code = cached_generate(model, prompt, use_cache=use_cache, keep=_is_valid_generated_code,
+                               format="", timeout=90)
         
+        # Strips markdown fences and AI preambles
         code = clean_generated_code(code)
         
         # Basic validation
@@ -395,13 +504,8 @@ Return ONLY the Python code. No explanations, no markdown blocks.""",
         return generate_stub_test_uidai(url, scenario.get("name", "Test"))
 
 
-def generate_stub_test_uidai(url: str, test_name: str = "UIDAI Basic Test") -> str:
-    """
-    Generate conservative stub test for UIDAI when AI generation fails
-    """
-    safe_name = re.sub(r'[^a-z0-9_]', '_', test_name.lower())
-    
-    return f'''import pytest
+# Source of the generic stub test; format_map fields: safe_name, test_name, url
+_UIDAI_STUB_TEMPLATE = '''import pytest
 from playwright.async_api import async_playwright
 import asyncio
 import os
@@ -467,43 +571,18 @@ async def test_{safe_name}():
         finally:
             await browser.close()
 '''
-def generate_scenario_stub(url: str, scenario: Dict[str, Any]) -> str:
+
+def generate_stub_test_uidai(url: str, test_name: str = "UIDAI Basic Test") -> str:
     """
-    Generate a CUSTOMIZED stub test based on the specific scenario template.
+    Generate conservative stub test for UIDAI when AI generation fails
     """
-    test_name = scenario['name']
-    description = scenario.get('description', 'Test scenario')
-    steps = scenario.get('steps', [])
-    validations = scenario.get('validations', [])
-    key_selectors = scenario.get('key_selectors', [])
-    
-    safe_name = re.sub(r'[^a-z0-9_]', '_', test_name.lower())
-    
-    # Build assertions (same as before - keep your existing code)
-    unique_assertions = []
-    for validation in validations[:6]:
-        if "title" in validation.lower() and "uidai" in validation.lower():
-            unique_assertions.append('            assert "UIDAI" in title or "Aadhaar" in title, "Page title should contain UIDAI or Aadhaar"')
-        elif "1947" in validation or "helpline" in validation.lower():
-            unique_assertions.append('            assert "1947" in content, "Helpline number 1947 should be displayed"')
-        elif "email" in validation.lower() or "help@uidai" in validation.lower():
-            unique_assertions.append('            assert "help@uidai.gov.in" in content, "Contact email should be present"')
+    safe_name = _SAFE_NAME_RE.sub('_', test_name.lower())
     
-    unique_selectors = []
-    for selector in key_selectors[:8]:
-        unique_selectors.append(f'''            try:
-                elem = await page.query_selector("{selector}")
-                if elem:
-                    print(f"✓ Found: {selector}")
-            except Exception as e:
-                print(f"⚠ Error checking {selector}: {{e}}")''')
-    
-    step_comments = '\n'.join([f'# Step {i+1}: {step}' for i, step in enumerate(steps[:12])])
-    assertions_code = '\n'.join(unique_assertions) if unique_assertions else '            pass'
-    selectors_code = '\n'.join(unique_selectors) if unique_selectors else '            pass'
-    
-    # FIXED: Use environment variable for artifacts path
-    return f'''import pytest
+    return _UIDAI_STUB_TEMPLATE.format_map({"safe_name": safe_name, "test_name": test_name, "url": url})
+
+# Source of a scenario stub test; format_map fields: safe_name, test_name, description,
+# url, assertions_code, selectors_code, step_comments
+_SCENARIO_STUB_TEMPLATE = '''import pytest
 from playwright.async_api import async_playwright
 import os
 from pathlib import Path
@@ -593,25 +672,168 @@ async def test_{safe_name}():
 # Scenario Steps:
 {step_comments}
 '''
-def fix_common_playwright_mistakes(code: str) -> str:
+
+# Per-selector element check in a scenario stub; format field: selector
+_SELECTOR_CHECK_TEMPLATE = '''            try:
+                elem = await page.query_selector("{selector}")
+                if elem:
+                    print(f"✓ Found: {selector}")
+            except Exception as e:
+                print(f"⚠ Error checking {selector}: {{e}}")'''
+
+# "# Step N: " comment prefixes for the (at most 12) scenario steps
+_STEP_PREFIXES = tuple(f"# Step {i+1}: " for i in range(12))
+
+def generate_scenario_stub(url: str, scenario: Dict[str, Any]) -> str:
     """
-    Fix common mistakes LLMs make with Playwright Python API
+    Generate a CUSTOMIZED stub test based on the specific scenario template.
     """
-    # Fix JavaScript-style camelCase to Python snake_case
-    fixes = {
-        'browser.newPage()': 'browser.new_page()',
-        'page.querySelector(': 'page.query_selector(',
-        'page.querySelectorAll(': 'page.query_selector_all(',
-        'page.waitForSelector(': 'page.wait_for_selector(',
-        'page.waitForTimeout(': 'page.wait_for_timeout(',
-        'page.waitForNavigation(': 'page.wait_for_navigation(',
-        'page.waitForLoadState(': 'page.wait_for_load_state(',
-    }
+    test_name = scenario['name']
+    description = scenario.get('description', 'Test scenario')
+    steps = scenario.get('steps', [])
+    validations = scenario.get('validations', [])
+    key_selectors = scenario.get('key_selectors', [])
+    
+    safe_name = _SAFE_NAME_RE.sub('_', test_name.lower())
     
-    for wrong, correct in fixes.items():
-        code = code.replace(wrong, correct)
+    # Build assertions (same as before - keep your existing code)
+    unique_assertions = []
+    for validation in validations[:6]:
+        if "title" in validation.lower() and "uidai" in validation.lower():
+            unique_assertions.append('            assert "UIDAI" in title or "Aadhaar" in title, "Page title should contain UIDAI or Aadhaar"')
+        elif "1947" in validation or "helpline" in validation.lower():
+            unique_assertions.append('            assert "1947" in content, "Helpline number 1947 should be displayed"')
+        elif "email" in validation.lower() or "help@uidai" in validation.lower():
+            unique_assertions.append('            assert "help@uidai.gov.in" in content, "Contact email should be present"')
+    
+    unique_selectors = [_SELECTOR_CHECK_TEMPLATE.format(selector=selector) for selector in key_selectors[:8]]
+    
+    step_comments = '\n'.join(_STEP_PREFIXES[i] + str(step) for i, step in enumerate(steps[:12]))
+    assertions_code = '\n'.join(unique_assertions) if unique_assertions else '            pass'
+    selectors_code = '\n'.join(unique_selectors) if unique_selectors else '            pass'
     
-    return code
+    # FIXED: Use environment variable for artifacts path
+    return _SCENARIO_STUB_TEMPLATE.format_map({
+        "safe_name": safe_name,
+        "test_name": test_name,
+        "description": description,
+        "url": url,
+        "assertions_code": assertions_code,
+        "selectors_code": selectors_code,
+        "step_comments": step_comments,
+    })
+
+def _format_scenario_context(scenario_obj: Dict[str, Any]) -> str:
+    """Scenario block of the test-generation prompt"""
+    steps = "\n".join('- ' + step for step in scenario_obj.get('steps', [])[:8])
+    validations = "\n".join('- ' + val for val in scenario_obj.get('validations', [])[:5])
+    key_selectors = "\n".join('- ' + sel for sel in scenario_obj.get('key_selectors', [])[:5])
+    return f"""
+                        Test Scenario: {scenario_obj.get('name', 'Custom scenario')}
+                        Description: {scenario_obj.get('description', '')}
+                        Key Areas to Test:
+                        {steps}
+
+                        Key Validations:
+                        {validations}
+
+                        Key Selectors to Check:
+                        {key_selectors}
+                        """
+
+# Prompt block of every built-in template, built once at import
+_TEMPLATE_SCENARIO_CONTEXTS = MappingProxyType({
+    key: _format_scenario_context(template) for key, template in SCENARIO_TEMPLATES.items()
+})
+
+def _template_scenario_context(template_key: str) -> str:
+    return _TEMPLATE_SCENARIO_CONTEXTS[template_key]
+
+# JavaScript-style camelCase Playwright calls -> Python snake_case
+_JS_TO_PY_FIXES = {
+    'browser.newPage()': 'browser.new_page()',
+    'page.querySelector(': 'page.query_selector(',
+    'page.querySelectorAll(': 'page.query_selector_all(',
+    'page.waitForSelector(': 'page.wait_for_selector(',
+    'page.waitForTimeout(': 'page.wait_for_timeout(',
+    'page.waitForNavigation(': 'page.wait_for_navigation(',
+    'page.waitForLoadState(': 'page.wait_for_load_state(',
+}
+# longest first so a key is never shadowed by one of its prefixes
+_JS_TO_PY_RE = re.compile("|".join(map(re.escape, sorted(_JS_TO_PY_FIXES, key=len, reverse=True))))
+
+def fix_common_playwright_mistakes(code: str) -> str:
+    """
+    Fix common mistakes LLMs make with Playwright Python API
+    """
+    # One pass over the code for all fixes
+    return _JS_TO_PY_RE.sub(lambda m: _JS_TO_PY_FIXES[m.group(0)], code)
+
+def _write_text_atomic(path: str, text: str):
+    """Write via a temp file and os.replace, so the runner never sees a torn test file"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8", buffering=1 << 16) as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+# Pages and selectors per page that the Ollama prompt builder actually reads
+_MODEL_PROMPT_PAGES = 3
+_MODEL_PROMPT_SELECTORS = 8
+
+def _model_prompt_pages(pages: List[Dict]) -> List[Dict]:
+    """
+    The slice of discovery output build_optimized_prompt uses (url, title, first
+    selectors of the first unique pages), so the LLM cache key does not hash
+    whole page dicts
+    """
+    return [
+        {"url": page.get("url", "N/A"), "title": page.get("title", "N/A"),
+         "selectors": page.get("selectors", [])[:_MODEL_PROMPT_SELECTORS]}
+        for page in islice(_unique_pages(pages), _MODEL_PROMPT_PAGES)
+    ]
+
+def _try_model(model: str, url: str, prompt_pages: List[Dict], scenario_text: Optional[str],
+               use_cache: bool = True) -> Optional[str]:
+    """One generation attempt: cleaned, fixed test code if it validates, else None"""
+    try:
+        print(f"🤖 Attempting generation with {model}...")
+        
+        try:
+            test_code = cached_generate(
+                model=model,
+                use_cache=use_cache,
+                keep=_is_valid_generated_code,
+                url=url,
+                pages=prompt_pages,
+                scenario_text=scenario_text
+            )
+        except Exception as e:
+            print(f"❌ Exception calling model: {e}")
+            test_code = None
+
+        # DEBUG: Log what we got back
+        if test_code:
+            # Clean and fix common mistakes
+            test_code = clean_generated_code(test_code)
+            test_code = fix_common_playwright_mistakes(test_code)
+            
+            print(f"🧹 [{model}] After cleaning (first 300 chars):")
+            print(test_code[:300])
+        else:
+            print(f"❌ Model {model} returned None")
+            return None
+        if validate_test_code(test_code):
+            return test_code
+        
+        print(f"❌ Validation failed for {model}")
+        # Check what's missing
+        missing = _missing_required_tokens(test_code)
+        print(f"   Missing: {', '.join(missing)}")
+        return None
+    except Exception as e:
+        print(f"❌ Model {model} failed: {e}")
+        return None
+
 def generate_tests(
     run_id: str,
     url: str,
@@ -619,15 +841,15 @@ def generate_tests(
     scenario: Optional[str] = None,
     custom_scenario: Optional[Dict[str, Any]] = None,
     models: Optional[List[str]] = None,
-    out_dir: str = "/tmp/uidai_runs"
+    out_dir: str = "/tmp/uidai_runs",
+    use_cache: bool = True
 ) -> Dict[str, Any]:
     """
     Main test generation function for UIDAI MVP
     """
     gen_dir = os.path.join(out_dir, run_id, "generator")
-    os.makedirs(gen_dir, exist_ok=True)
     tests_dir = os.path.join(gen_dir, "tests")
-    os.makedirs(tests_dir, exist_ok=True)
+    os.makedirs(tests_dir, exist_ok=True)  # creates gen_dir too
 
     # Load scenario template
     scenario_obj = None
@@ -645,102 +867,72 @@ def generate_tests(
 
     # Try AI generation with Ollama models
     if models:
-        for model in models:
-            try:
-                print(f"🤖 Attempting generation with {model}...")
-                
-                # Build scenario context for prompt
-                scenario_context = ""
-                if scenario_obj:
-                    scenario_context = f"""
-                        Test Scenario: {scenario_obj.get('name', 'Custom scenario')}
-                        Description: {scenario_obj.get('description', '')}
-                        Key Areas to Test:
-                        {chr(10).join(['- ' + step for step in scenario_obj.get('steps', [])[:8]])}
-
-                        Key Validations:
-                        {chr(10).join(['- ' + val for val in scenario_obj.get('validations', [])[:5]])}
-
-                        Key Selectors to Check:
-                        {chr(10).join(['- ' + sel for sel in scenario_obj.get('key_selectors', [])[:5]])}
-                        """
-
-                try:
-                    test_code = generate_with_model(
-                        model=model,
-                        url=url,
-                        pages=pages[:3],
-                        scenario_text=scenario_context if scenario_obj else None
-                    )
-                except Exception as e:
-                    print(f"❌ Exception calling model: {e}")
-                    test_code = None
-
-                # DEBUG: Log what we got back
+        # Scenario context for the prompt - the same for every model, so built once
+        # (and once per process for the built-in templates)
+        scenario_context = ""
+        if template_key:
+            scenario_context = _template_scenario_context(template_key)
+        elif scenario_obj:
+            scenario_context = _format_scenario_context(scenario_obj)
+        
+        scenario_text = scenario_context if scenario_obj else None
+        prompt_pages = _model_prompt_pages(pages)
+        
+        # Up to GENERATOR_MODEL_CONCURRENCY models run at once, in preference
+        # order; the first valid test wins. Queued models are then cancelled and
+        # running losers are not waited for (their request finishes in the background).
+        executor = ThreadPoolExecutor(max_workers=min(len(models), GENERATOR_MODEL_CONCURRENCY))
+        futures = {
+            executor.submit(_try_model, model, url, prompt_pages, scenario_text, use_cache): model
+            for model in models
+        }
+        winner, test_code = None, None
+        try:
+            for future in as_completed(futures):
+                test_code = future.result()
                 if test_code:
-                    # Clean and fix common mistakes
-                    test_code = clean_generated_code(test_code)
-                    test_code = fix_common_playwright_mistakes(test_code)  # ADD THIS LINE
-                    
-                    print(f"🧹 After cleaning (first 300 chars):")
-                    print(test_code[:300])
-                else:
-                    print(f"❌ Model returned None")
-                    continue
-                if test_code and validate_test_code(test_code):
-                    # Generate filename based on scenario
-                    if scenario_obj:
-                        safe_name = re.sub(r'[^a-z0-9_]', '_', scenario_obj['name'].lower())
-                        test_filename = f"test_{safe_name}.py"
-                    else:
-                        test_filename = f"test_auto_{run_id[:8]}.py"
-                    
-                    test_path = os.path.join(tests_dir, test_filename)
-                    
-                    with open(test_path, "w", encoding="utf-8") as f:
-                        f.write(test_code)
-                    
-                    lines = len(test_code.split('\n'))
-                    print(f"✅ Generated test with {model}: {lines} lines")
-                    
-                    return {
-                        "ok": True,
-                        "tests": [{
-                            "filename": test_filename,
-                            "path": test_path,
-                            "lines": lines,
-                            "content": test_code,
-                            "model": model,
-                            "scenario": scenario_obj['name'] if scenario_obj else "Auto-discovery"
-                        }],
-                        "count": 1,
-                        "scenario": scenario_obj,
-                        "scenario_source": f"template:{template_key}" if template_key else "ai",
-                        "metadata": {
-                            "runId": run_id,
-                            "url": url,
-                            "models_tried": [model],
-                            "model": model,
-                            "seed": scenario_obj.get('name') if scenario_obj else None,
-                            "scenario_id": template_key if template_key else "auto"
-                        }
-                    }
-                else:
-                    print(f"❌ Validation failed")
-                    if test_code:
-                        # Check what's missing
-                        missing = []
-                        if 'playwright' not in test_code.lower():
-                            missing.append('playwright')
-                        if 'async def test_' not in test_code.lower():
-                            missing.append('async def test_')
-                        if 'await page.' not in test_code.lower():
-                            missing.append('await page.')
-                        print(f"   Missing: {', '.join(missing)}")
-                    continue  
-            except Exception as e:
-                print(f"❌ Model {model} failed: {e}")
-                continue
+                    winner = futures[future]
+                    break
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        if winner:
+            # Generate filename based on scenario
+            if scenario_obj:
+                safe_name = _SAFE_NAME_RE.sub('_', scenario_obj['name'].lower())
+                test_filename = f"test_{safe_name}.py"
+            else:
+                test_filename = f"test_auto_{run_id[:8]}.py"
+            
+            test_path = os.path.join(tests_dir, test_filename)
+            
+            _write_text_atomic(test_path, test_code)
+            
+            lines = len(test_code.split('\n'))
+            print(f"✅ Generated test with {winner}: {lines} lines")
+            
+            return {
+                "ok": True,
+                "tests": [{
+                    "filename": test_filename,
+                    "path": test_path,
+                    "lines": lines,
+                    "content": test_code,
+                    "model": winner,
+                    "scenario": scenario_obj['name'] if scenario_obj else "Auto-discovery"
+                }],
+                "count": 1,
+                "scenario": scenario_obj,
+                "scenario_source": f"template:{template_key}" if template_key else "ai",
+                "metadata": {
+                    "runId": run_id,
+                    "url": url,
+                    "models_tried": list(models),
+                    "model": winner,
+                    "seed": scenario_obj.get('name') if scenario_obj else None,
+                    "scenario_id": template_key if template_key else "auto"
+                }
+            }
 
     # Fallback: Generate scenario-specific stub
     print(f"⚠️ AI generation failed or disabled. Generating scenario-specific stub...")
@@ -748,7 +940,7 @@ def generate_tests(
     if scenario_obj:
         # CRITICAL: Generate DIFFERENT stub for each scenario
         test_name = scenario_obj['name']
-        safe_name = re.sub(r'[^a-z0-9_]', '_', test_name.lower())
+        safe_name = _SAFE_NAME_RE.sub('_', test_name.lower())
         test_filename = f"test_{safe_name}.py"
         
         # Generate customized stub based on scenario
@@ -765,8 +957,7 @@ def generate_tests(
     
     test_path = os.path.join(tests_dir, test_filename)
     
-    with open(test_path, "w", encoding="utf-8") as f:
-        f.write(test_code)
+    _write_text_atomic(test_path, test_code)
     
     lines = len(test_code.split('\n'))
     
@@ -4,21 +4,52 @@ import json
 import logging
 import requests
 import ast
-from typing import List, Dict, Any
+import re
+from functools import lru_cache
+from typing import List, Dict, Any, Optional
 from pathlib import Path
+from . import llm_cache
 
 log = logging.getLogger(__name__)
 OLLAMA_HTTP = os.getenv("OLLAMA_HTTP", "http://localhost:11434")
 
+# Sampling options for healing requests; part of the LLM cache key
+_HEAL_OPTIONS = {"temperature": 0.1, "num_predict": 2000}
+
+# Fixed instructions sent as Ollama's system prompt. Every healing request
+# starts with the same tokens, so the loaded model can reuse their KV cache.
+_HEAL_SYSTEM_PROMPT = """You are a Python test repair expert. Fix the broken test you are given.
+
+TASK: Generate COMPLETE, VALID, RUNNABLE Python code that fixes the test.
+
+REQUIREMENTS:
+1. Return ONLY valid Python code (no markdown, no explanations)
+2. Include ALL necessary imports
+3. Keep pytest decorators (@pytest.mark.asyncio)
+4. Fix the specific error (timeout, selector, syntax)
+5. Code MUST be syntactically valid Python
+6. Use proper string quotes and escaping
+7. Common fixes:
+   - Increase timeout to 60000
+   - Use wait_until="domcontentloaded" instead of "networkidle"
+   - Add try-except for resilience
+   - Add wait times with await page.wait_for_timeout(1000)"""
+
+def _heal_cache_key(model: str, prompt: str) -> str:
+    return llm_cache.key(model, {"system": _HEAL_SYSTEM_PROMPT, "prompt": prompt}, _HEAL_OPTIONS)
+
 def get_heal_suggestions(
     run_id: str, 
     failingTestInfo: dict, 
     generated_files: list, 
     models: list = None, 
-    out_dir: str = "/tmp/uidai_runs"
+    out_dir: str = "/tmp/uidai_runs",
+    use_cache: bool = True
 ) -> Dict[str, Any]:
     """
-    Generate healing suggestions using Ollama
+    Generate healing suggestions using Ollama.
+    A response that yielded valid code is reused for the same model and prompt
+    unless use_cache is False.
     """
     out_dir = Path(out_dir) / run_id / "healer"
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -51,9 +82,8 @@ def get_heal_suggestions(
         except Exception as e:
             log.warning(f"Could not read test file: {e}")
     
-    prompt = f"""You are a Python test repair expert. Fix this broken test.
-
-CURRENT BROKEN TEST CODE:
+    # Only the volatile part goes in the prompt; the instructions are the system prompt
+    prompt = f"""CURRENT BROKEN TEST CODE:
 ```python
 {test_file_content[:2000] if test_file_content else "# No code available"}
 ```
@@ -61,42 +91,31 @@ CURRENT BROKEN TEST CODE:
 ERROR:
 {failures_text}
 
-TASK: Generate COMPLETE, VALID, RUNNABLE Python code that fixes the test.
-
-REQUIREMENTS:
-1. Return ONLY valid Python code (no markdown, no explanations)
-2. Include ALL necessary imports
-3. Keep pytest decorators (@pytest.mark.asyncio)
-4. Fix the specific error (timeout, selector, syntax)
-5. Code MUST be syntactically valid Python
-6. Use proper string quotes and escaping
-7. Common fixes:
-   - Increase timeout to 60000
-   - Use wait_until="domcontentloaded" instead of "networkidle"
-   - Add try-except for resilience
-   - Add wait times with await page.wait_for_timeout(1000)
-
 Return ONLY the complete fixed Python code, nothing else:"""
     
     for model in models:
         try:
-            log.info(f"🔧 Requesting healing from {model}...")
-            
-            response = requests.post(
-                f"{OLLAMA_HTTP}/api/generate",
-                json={
-                    "model": model,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {"temperature": 0.1, "num_predict": 2000}
-                },
-                timeout=120
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                response_text = result.get("response", "")
+            cached = llm_cache.get(_heal_cache_key(model, prompt)) if use_cache and llm_cache.enabled() else None
+            if cached is not None:
+                log.info(f"🔧 Reusing cached healing from {model}")
+                response_text = cached
+            else:
+                log.info(f"🔧 Requesting healing from {model}...")
                 
+                response = requests.post(
+                    f"{OLLAMA_HTTP}/api/generate",
+                    json={
+                        "model": model,
+                        "system": _HEAL_SYSTEM_PROMPT,
+                        "prompt": prompt,
+                        "stream": False,
+                        "options": _HEAL_OPTIONS
+                    },
+                    timeout=120
+                )
+                response_text = response.json().get("response", "") if response.status_code == 200 else None
+            
+            if response_text is not None:
                 # Save raw response
                 (out_dir / f"{model.replace(':', '_')}.raw.txt").write_text(response_text)
                 
@@ -105,6 +124,8 @@ Return ONLY the complete fixed Python code, nothing else:"""
                 
                 if code and validate_python_syntax(code):
                     log.info(f"✅ Got valid Python code from {model}")
+                    if cached is None and use_cache and llm_cache.enabled():
+                        llm_cache.put(_heal_cache_key(model, prompt), response_text)
                     return {
                         "ok": True,
                         "suggestions": [{
@@ -167,30 +188,52 @@ def extract_code_from_response(response: str) -> str:
     # If no code blocks, assume entire response is code
     return response.strip()
 
-def validate_python_syntax(code: str) -> bool:
-    """Validate that code is syntactically valid Python"""
+@lru_cache(maxsize=64)
+def _parse_error(code: str) -> Optional[str]:
+    """ast.parse failure message for code, or None if it parses.
+    Memoized: a suggestion is parsed by the healer and again by apply_patch."""
     try:
         ast.parse(code)
-        log.info("✓ Code is syntactically valid Python")
-        return True
+        return None
     except SyntaxError as e:
-        log.error(f"✗ Syntax error in generated code: {e}")
-        return False
+        return f"Syntax error in generated code: {e}"
     except Exception as e:
-        log.error(f"✗ Error parsing code: {e}")
-        return False
+        return f"Error parsing code: {e}"
+
+def validate_python_syntax(code: str) -> bool:
+    """Validate that code is syntactically valid Python"""
+    error = _parse_error(code)
+    if error is None:
+        log.info("✓ Code is syntactically valid Python")
+        return True
+    log.error(f"✗ {error}")
+    return False
+
+# Literal rewrites done by apply_basic_fixes
+_TIMEOUT_FIXES = {
+    'timeout=30000': 'timeout=60000',
+    'timeout=30_000': 'timeout=60_000',
+}
+_WAIT_FIXES = {
+    'wait_until="networkidle"': 'wait_until="domcontentloaded"',
+    "wait_until='networkidle'": "wait_until='domcontentloaded'",
+}
+_BASIC_TEXT_FIXES = {**_TIMEOUT_FIXES, **_WAIT_FIXES}
+_WAIT_FIX_RE = re.compile("|".join(map(re.escape, _WAIT_FIXES)))
+_TIMEOUT_AND_WAIT_FIX_RE = re.compile("|".join(map(re.escape, _BASIC_TEXT_FIXES)))
 
 def apply_basic_fixes(test_code: str, failures_text: str) -> str:
     """
     Apply common automated fixes to test code
     """
-    fixed_code = test_code
+    timed_out = "Timeout" in failures_text or "timeout" in failures_text
     
-    # Fix 1: Increase all timeouts
-    if "Timeout" in failures_text or "timeout" in failures_text:
-        fixed_code = fixed_code.replace('timeout=30000', 'timeout=60000')
-        fixed_code = fixed_code.replace('timeout=30_000', 'timeout=60_000')
-        
+    # Fix 1 (timeouts, only after a timeout failure) and Fix 2 (networkidle ->
+    # domcontentloaded, more reliable) as one pass over the code
+    fix_re = _TIMEOUT_AND_WAIT_FIX_RE if timed_out else _WAIT_FIX_RE
+    fixed_code = fix_re.sub(lambda m: _BASIC_TEXT_FIXES[m.group(0)], test_code)
+    
+    if timed_out:
         # Add timeout to page.goto if missing
         if 'await page.goto(' in fixed_code:
             lines = fixed_code.split('\n')
@@ -205,17 +248,6 @@ def apply_basic_fixes(test_code: str, failures_text: str) -> str:
                 new_lines.append(line)
             fixed_code = '\n'.join(new_lines)
     
-    # Fix 2: Change networkidle to domcontentloaded (more reliable)
-    if "networkidle" in fixed_code:
-        fixed_code = fixed_code.replace(
-            'wait_until="networkidle"', 
-            'wait_until="domcontentloaded"'
-        )
-        fixed_code = fixed_code.replace(
-            "wait_until='networkidle'", 
-            "wait_until='domcontentloaded'"
-        )
-    
     # Fix 3: Add wait after navigation
     if 'await page.goto(' in fixed_code and 'await page.wait_for_timeout' not in fixed_code:
         lines = fixed_code.split('\n')
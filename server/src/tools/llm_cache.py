@@ -0,0 +1,100 @@
+# server/src/tools/llm_cache.py
+"""
+Persistent LLM response cache shared by the generator and the healer.
+sqlite file keyed by a SHA-256 of model + prompt payload + options.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict
+
+try:
+    import orjson
+except ImportError:  # optional - stdlib json is used for cached values without it
+    orjson = None
+
+log = logging.getLogger(__name__)
+
+# Off unless UIDAI_LLM_CACHE names a file: cached values are test code that is
+# written out and executed, so the file must be private to this server (0600)
+LLM_CACHE_PATH = os.getenv("UIDAI_LLM_CACHE", "")
+
+# Part of every cache key. Bump LLM_CACHE_VERSION when the way cached answers are
+# produced changes; edits to ollama_client.py (the prompt templates applied by
+# generate_with_model) change the key on their own via its source hash
+LLM_CACHE_VERSION = 1
+try:
+    _PROMPT_SOURCE_HASH = hashlib.sha256(
+        Path(__file__).with_name("ollama_client.py").read_bytes()).hexdigest()[:16]
+except OSError:
+    _PROMPT_SOURCE_HASH = ""
+
+# Cached values are stored as JSON bytes
+if orjson is not None:
+    _loads = orjson.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+else:
+    _loads = json.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+def enabled() -> bool:
+    return bool(LLM_CACHE_PATH)
+
+def key(model: str, payload: Any, options: Dict[str, Any]) -> str:
+    canonical = json.dumps({"version": [LLM_CACHE_VERSION, _PROMPT_SOURCE_HASH],
+                            "model": model, "payload": payload, "options": options},
+                           sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _connect() -> sqlite3.Connection:
+    """
+    Open the cache, creating it owner-only (0600). A file that is a symlink, owned
+    by another user or readable/writable by others is refused - anyone able to
+    write it could get their code run as a generated test
+    """
+    try:
+        fd = os.open(LLM_CACHE_PATH, os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0), 0o600)
+        try:
+            st = os.fstat(fd)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        raise sqlite3.OperationalError(f"cannot open LLM cache {LLM_CACHE_PATH}: {e}") from e
+    if (hasattr(os, "getuid") and st.st_uid != os.getuid()) or st.st_mode & 0o077:
+        raise sqlite3.OperationalError(f"LLM cache {LLM_CACHE_PATH} is not private to this user; not using it")
+    conn = sqlite3.connect(LLM_CACHE_PATH, timeout=10)
+    conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB)")
+    return conn
+
+def get(cache_key: str) -> Any:
+    """Cached value for cache_key (decoded JSON); None on a miss or a cache error"""
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute("SELECT value FROM kv WHERE key = ?", (cache_key,)).fetchone()
+        finally:
+            conn.close()
+        return _loads(row[0]) if row is not None else None
+    except (sqlite3.Error, ValueError) as e:
+        log.warning(f"LLM cache read failed: {e}")
+        return None
+
+def put(cache_key: str, value: Any):
+    """Store value under cache_key; a cache error is logged, never raised"""
+    try:
+        conn = _connect()
+        try:
+            with conn:  # one transaction, committed on exit
+                conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (cache_key, _dumps(value)))
+        finally:
+            conn.close()
+    except (sqlite3.Error, TypeError) as e:
+        log.warning(f"LLM cache write failed: {e}")
@@ -1,9 +1,20 @@
 # server/src/tools/minio_client.py
+import io
 import os
 import logging
+import queue
+import socket
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterable, Iterator
 from urllib.parse import urlparse
 
+import certifi
+import urllib3
+from urllib3.connection import HTTPConnection
 from minio import Minio
 from minio.error import S3Error
 
@@ -19,8 +30,19 @@ _MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
 # Optional: explicit override; if not set we infer from scheme in endpoint (https -> secure)
 _MINIO_SECURE_ENV = os.getenv("MINIO_SECURE", None)
 MINIO_BUCKET = os.getenv("MINIO_BUCKET", "uidai-artifacts")
+# Concurrent uploads in upload_dir; each upload is latency-bound
+MINIO_UPLOAD_WORKERS = int(os.getenv("MINIO_UPLOAD_WORKERS", "16"))
+# Files below this size are read once and sent with put_object (single PUT);
+# larger ones go through fput_object's multipart path
+_SMALL_OBJECT_BYTES = 5 * 1024 * 1024
+# Socket buffer size for MinIO connections (default kernel/urllib3 sizes cap per-stream throughput)
+_MINIO_SOCKET_BUFFER_BYTES = int(os.getenv("MINIO_SOCKET_BUFFER_BYTES", str(1 << 20)))
 
 _client: Minio | None = None
+_client_lock = threading.Lock()
+# Skip the bucket_exists/make_bucket round trip when the bucket is provisioned out of band
+_MINIO_ASSUME_BUCKET_EXISTS = os.getenv("MINIO_ASSUME_BUCKET_EXISTS", "0") == "1"
+_bucket_checked: set[str] = set()
 
 
 def _normalize_minio_endpoint(raw: str, secure_env: str | None):
@@ -72,6 +94,27 @@ def _normalize_minio_endpoint(raw: str, secure_env: str | None):
     return host_port, bool(secure)
 
 
+def _build_http_client() -> urllib3.PoolManager:
+    """
+    Same policy as the SDK's default pool (5 min timeouts, retries on 5xx,
+    certifi/SSL_CERT_FILE CAs) but sized for the parallel uploaders and with
+    larger socket buffers; TCP_NODELAY comes from urllib3's default options.
+    """
+    timeout = 300
+    return urllib3.PoolManager(
+        timeout=urllib3.util.Timeout(connect=timeout, read=timeout),
+        maxsize=max(32, MINIO_UPLOAD_WORKERS),
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+        retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+        socket_options=HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_SNDBUF, _MINIO_SOCKET_BUFFER_BYTES),
+            (socket.SOL_SOCKET, socket.SO_RCVBUF, _MINIO_SOCKET_BUFFER_BYTES),
+        ],
+        blocksize=1 << 16,  # read 64 KiB at a time instead of 8 KiB
+    )
+
+
 def get_client() -> Minio | None:
     """
     Returns a cached Minio client or None if MinIO not configured.
@@ -80,7 +123,14 @@ def get_client() -> Minio | None:
     global _client
     if _client is not None:
         return _client
+    with _client_lock:
+        if _client is None:
+            _client = _create_client()
+        return _client
+
 
+def _create_client() -> Minio | None:
+    """Build the client and ensure the bucket; called once under _client_lock"""
     # quick check: fail fast if auth missing
     if not (_RAW_MINIO_ENDPOINT and _MINIO_ACCESS_KEY and _MINIO_SECRET_KEY):
         log.warning("MinIO not configured (MINIO_ENDPOINT / AUTH missing). Uploads will be skipped.")
@@ -95,53 +145,95 @@ def get_client() -> Minio | None:
     log.info("Creating MinIO client with endpoint=%s secure=%s", endpoint, secure)
 
     try:
-        _client = Minio(
+        client = Minio(
             endpoint=endpoint,
             access_key=_MINIO_ACCESS_KEY,
             secret_key=_MINIO_SECRET_KEY,
             secure=secure,
+            http_client=_build_http_client(),
         )
     except Exception:
         log.exception("Failed creating MinIO client (check endpoint/credentials).")
         return None
 
-    # ensure bucket exists (idempotent). Don't fail hard — just log.
+    _ensure_bucket(client)
+    return client
+
+
+def _ensure_bucket(client: Minio):
+    """Check/create MINIO_BUCKET at most once per process (idempotent). Don't fail hard — just log."""
+    if _MINIO_ASSUME_BUCKET_EXISTS or MINIO_BUCKET in _bucket_checked:
+        return
     try:
-        if not _client.bucket_exists(MINIO_BUCKET):
-            _client.make_bucket(MINIO_BUCKET)
+        if not client.bucket_exists(MINIO_BUCKET):
+            client.make_bucket(MINIO_BUCKET)
             log.info("Created missing MinIO bucket: %s", MINIO_BUCKET)
+        _bucket_checked.add(MINIO_BUCKET)
     except Exception:
         log.exception("Failed to ensure MinIO bucket '%s' exists; uploads may still fail.", MINIO_BUCKET)
 
-    return _client
+
+_RUNS_ROOT = "/tmp/uidai_runs"
 
 
-def _object_key_for_path(run_id: str, local_path: Path) -> str:
+def _object_key_for_path(run_id: str, local_path: str | Path) -> str:
     """
     store under key: <runId>/<relative path from /tmp/uidai_runs/<runId>> or fallback to file name
+    String ops only - called once per uploaded file.
     """
-    try:
-        rel = local_path.relative_to(Path("/tmp/uidai_runs") / run_id)
-    except Exception:
+    local_path = os.fspath(local_path)
+    run_root = f"{_RUNS_ROOT}/{run_id}{os.sep}"
+    if local_path.startswith(run_root):
+        rel = local_path[len(run_root):].replace(os.sep, "/")
+    else:
         # fallback: use file name only
-        rel = local_path.name
-    return f"{run_id}/{Path(rel).as_posix()}"
+        rel = local_path.rsplit(os.sep, 1)[-1]
+    return f"{run_id}/{rel}"
 
 
-def upload_file(run_id: str, local_path: str, content_type: str = None) -> str | None:
+def _iter_files(root: str):
+    """
+    Yield file paths (str) under root, depth-first, via os.scandir.
+    DirEntry caches the type from the directory read, so no extra stat per entry.
+    """
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        yield entry.path
+        except OSError as e:
+            log.warning("upload_dir: cannot list %s: %s", current, e)
+
+
+def _put_path(client: Minio, key: str, path: str):
+    """Upload one local file, in memory when it is small"""
+    if os.stat(path).st_size < _SMALL_OBJECT_BYTES:
+        with open(path, "rb") as fh:
+            data = fh.read()
+        client.put_object(MINIO_BUCKET, key, io.BytesIO(data), len(data))
+    else:
+        client.fput_object(MINIO_BUCKET, key, path)
+
+
+def upload_file(run_id: str, local_path: str | Path, content_type: str = None) -> str | None:
     """
     Upload single file. Returns object key on success (e.g. <runId>/path) or None
     """
     client = get_client()
     if client is None:
         return None
-    lp = Path(local_path)
-    if not lp.exists() or not lp.is_file():
+    lp = os.fspath(local_path)
+    if not os.path.isfile(lp):
         log.warning("upload_file: path not found or not a file: %s", local_path)
         return None
     key = _object_key_for_path(run_id, lp)
     try:
-        client.fput_object(MINIO_BUCKET, key, str(lp))
+        _put_path(client, key, lp)
         log.info("Uploaded %s -> s3://%s/%s", lp, MINIO_BUCKET, key)
         return key
     except S3Error as e:
@@ -164,13 +256,108 @@ def upload_dir(run_id: str, local_dir: str) -> list:
     if not p.exists():
         log.warning("upload_dir: dir not found: %s", local_dir)
         return uploaded
-    for f in p.rglob("*"):
-        if f.is_file():
-            key = _object_key_for_path(run_id, f)
-            try:
-                client.fput_object(MINIO_BUCKET, key, str(f))
-                uploaded.append(key)
-            except Exception as e:
-                log.exception("Failed to upload %s: %s", f, e)
+    # materialize the listing first so the tree walk is not interleaved with network waits
+    files = list(_iter_files(str(p)))
+
+    def _upload(f: str) -> str | None:
+        key = _object_key_for_path(run_id, f)
+        try:
+            _put_path(client, key, f)
+            return key
+        except Exception as e:
+            log.exception("Failed to upload %s: %s", f, e)
+            return None
+
+    # the Minio client is safe to share across threads for independent requests
+    if files:
+        with ThreadPoolExecutor(max_workers=max(1, min(MINIO_UPLOAD_WORKERS, len(files)))) as ex:
+            uploaded = [key for key in ex.map(_upload, files) if key]
     log.info("Completed upload_dir %s -> %d objects", local_dir, len(uploaded))
     return uploaded
+
+
+def upload_dir_bundled(run_id: str, local_dir: str, name: str = "artifacts") -> list:
+    """
+    Upload everything under local_dir as one <runId>/<name>.tar.gz object.
+    One PUT instead of one per file - for directories of many tiny artifacts.
+    Returns [key] on success, [] otherwise.
+    """
+    client = get_client()
+    if client is None:
+        return []
+    root = os.fspath(local_dir)
+    if not os.path.isdir(root):
+        log.warning("upload_dir_bundled: dir not found: %s", local_dir)
+        return []
+    key = f"{run_id}/{name}.tar.gz"
+    count = 0
+    try:
+        # spills to disk only for unusually large bundles
+        with tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024) as buf:
+            with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+                for f in _iter_files(root):
+                    tar.add(f, arcname=os.path.relpath(f, root).replace(os.sep, "/"))
+                    count += 1
+            length = buf.tell()
+            buf.seek(0)
+            client.put_object(MINIO_BUCKET, key, buf, length, content_type="application/gzip")
+    except Exception as e:
+        log.exception("MinIO upload_dir_bundled error for %s: %s", local_dir, e)
+        return []
+    log.info("Uploaded bundle %s (%d files) -> s3://%s/%s", local_dir, count, MINIO_BUCKET, key)
+    return [key]
+
+
+_PREFETCH_DONE = object()
+
+
+def _prefetched(iterable: Iterable, depth: int = 2) -> Iterator:
+    """
+    Drain `iterable` on a background thread, at most `depth` items ahead.
+    Lets paginated listings fetch the next page while the caller processes this one.
+    """
+    q: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def _put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce():
+        try:
+            for item in iterable:
+                if not _put(item):
+                    return  # consumer went away
+        except Exception as e:
+            _put(e)
+        finally:
+            _put(_PREFETCH_DONE)
+
+    threading.Thread(target=_produce, daemon=True).start()
+    try:
+        while True:
+            item = q.get()
+            if item is _PREFETCH_DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def list_run_artifacts(run_id: str) -> Iterator[str]:
+    """
+    Yield object keys stored under <runId>/ (recursive). Yields nothing if MinIO not configured.
+    """
+    client = get_client()
+    if client is None:
+        return
+    objects = client.list_objects(MINIO_BUCKET, prefix=f"{run_id}/", recursive=True)
+    for obj in _prefetched(objects):
+        yield obj.object_name
@@ -2,19 +2,35 @@
 """
 Real-time progress tracking using WebSocket
 """
+import asyncio
+import atexit
 import json
 import logging
-from typing import Dict, Any, Set
+import threading
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from typing import Dict, Any, Set, Optional
 from datetime import datetime
 
 log = logging.getLogger(__name__)
 
+# Broadcasts queued on the event loop before publish() starts waiting on them
+MAX_INFLIGHT_BROADCASTS = 256
+
 class ProgressTracker:
     """Manages real-time progress updates for test runs"""
     
     def __init__(self):
         self.connections: Dict[str, Set] = {}  # run_id -> set of websockets
         self.progress_data: Dict[str, Dict] = {}  # run_id -> progress info
+        self._last_progress: Dict[str, tuple] = {}  # run_id -> last broadcast key
+        self._loop: Optional[asyncio.AbstractEventLoop] = None  # loop owning the websockets
+        self._inflight: Set[Future] = set()
+        self._inflight_lock = threading.Lock()
+        self._thread_loops = threading.local()  # per-thread loop when no server loop is bound
+    
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """Remember the server event loop so worker threads can publish onto it"""
+        self._loop = loop
     
     def register_connection(self, run_id: str, websocket):
         """Register a WebSocket connection for a run"""
@@ -36,13 +52,20 @@ class ProgressTracker:
         if run_id not in self.connections:
             return
         
-        # Store latest progress
-        self.progress_data[run_id] = {
-            **progress,
-            "timestamp": datetime.utcnow().isoformat()
-        }
+        # Skip re-emits of an unchanged phase/status/progress
+        key = (progress.get("phase"), progress.get("status"),
+               progress.get("progress"), progress.get("details"))
+        if self._last_progress.get(run_id) == key:
+            return
+        self._last_progress[run_id] = key
+        
+        # Store latest progress - update_phase() already builds a fresh, stamped
+        # dict, so keep it as the snapshot instead of copying it again
+        if "timestamp" not in progress:
+            progress["timestamp"] = datetime.utcnow().isoformat()
+        self.progress_data[run_id] = progress
         
-        message = json.dumps(self.progress_data[run_id])
+        message = json.dumps(progress)
         
         # Send to all connected clients
         disconnected = set()
@@ -57,6 +80,58 @@ class ProgressTracker:
         for ws in disconnected:
             self.connections[run_id].discard(ws)
     
+    def publish(self, run_id: str, progress: Dict[str, Any]):
+        """
+        Broadcast from a pipeline thread without waiting on socket flushes.
+        
+        The send is scheduled on the server loop; only when too many sends are
+        still in flight does the caller block, until one of them finishes.
+        """
+        if self._loop is None or self._loop.is_closed():
+            self._fallback_loop().run_until_complete(self.broadcast_progress(run_id, progress))
+            return
+        
+        with self._inflight_lock:
+            pending = set(self._inflight)
+        if len(pending) >= MAX_INFLIGHT_BROADCASTS:
+            wait(pending, return_when=FIRST_COMPLETED)
+        
+        future = asyncio.run_coroutine_threadsafe(
+            self.broadcast_progress(run_id, progress), self._loop
+        )
+        with self._inflight_lock:
+            self._inflight.add(future)
+        future.add_done_callback(self._broadcast_done)
+    
+    def _fallback_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        This thread's loop for publishing without a server loop (scripts, tests).
+        Kept for reuse: asyncio.run() would build and close a loop on every publish.
+        """
+        loop = getattr(self._thread_loops, "loop", None)
+        if loop is None or loop.is_closed():
+            loop = asyncio.new_event_loop()
+            self._thread_loops.loop = loop
+            atexit.register(loop.close)
+        return loop
+    
+    def _broadcast_done(self, future: Future):
+        with self._inflight_lock:
+            self._inflight.discard(future)
+        if not future.cancelled() and future.exception():
+            log.error(f"Progress broadcast failed: {future.exception()}")
+    
+    def finish_run(self, run_id: str):
+        """Forget dedup state once a run's pipeline has ended"""
+        if self._loop is None or self._loop.is_closed():
+            self._last_progress.pop(run_id, None)
+            return
+        # Scheduled like a broadcast so it runs after the run's queued ones
+        asyncio.run_coroutine_threadsafe(self._forget_run(run_id), self._loop)
+    
+    async def _forget_run(self, run_id: str):
+        self._last_progress.pop(run_id, None)
+    
     def get_progress(self, run_id: str) -> Dict[str, Any]:
         """Get current progress for a run"""
         return self.progress_data.get(run_id, {})
@@ -7,6 +7,7 @@ FIXED: Generates Python code, not JavaScript
 import subprocess
 import logging
 from pathlib import Path
+from playwright.sync_api import sync_playwright
 
 log = logging.getLogger(__name__)
 
@@ -175,8 +176,6 @@ def launch_inspector_recorder(run_id: str, url: str, output_dir: Path) -> dict:
     """
     Alternative: Launch browser with Inspector using Playwright API
     """
-    from playwright.sync_api import sync_playwright
-    
     log.info(f"[{run_id}] 🎥 Launching Inspector Recorder...")
     
     print("\n" + "="*70)
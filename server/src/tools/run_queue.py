@@ -0,0 +1,74 @@
+# server/src/tools/run_queue.py
+"""
+Bounded run dispatcher - queued pipelines drained by a fixed set of worker threads
+"""
+import itertools
+import logging
+import queue
+import threading
+from typing import Callable, Dict, Any, List
+
+log = logging.getLogger(__name__)
+
+
+class _RankedPriorityQueue(queue.PriorityQueue):
+    """PriorityQueue whose put can report how many queued entries are ahead"""
+
+    def put_ranked(self, item) -> int:
+        """Add item (never blocks - unbounded) and return its 1-based dispatch
+        position, counted under the queue's own lock so a concurrent get()
+        cannot land between the count and the insert"""
+        with self.not_full:
+            ahead = sum(1 for queued in self.queue if queued[:2] < item[:2])
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+        return ahead + 1
+
+
+class RunQueueManager:
+    """Queues pipeline runs and executes at most `max_concurrent` of them at once"""
+
+    def __init__(self, max_concurrent: int = 5):
+        self.max_concurrent = max(1, max_concurrent)
+        # (priority, seq, run_id, config) - seq keeps equal priorities FIFO
+        self.queue: _RankedPriorityQueue = _RankedPriorityQueue()
+        self._seq = itertools.count()
+        self._workers: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def start(self, pipeline: Callable[[str, dict], None]):
+        """Start the long-lived worker threads (idempotent)"""
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.max_concurrent):
+                worker = threading.Thread(
+                    target=self._worker_loop,
+                    args=(pipeline,),
+                    name=f"run-worker-{i}",
+                    daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+        log.info(f"Run queue started with {self.max_concurrent} workers")
+
+    def enqueue_run(self, run_id: str, config: Dict[str, Any], priority: int = 0) -> int:
+        """
+        Queue a run and return its position (1 = dispatched next); lower priority
+        values are dispatched first, so only higher-or-equal-priority runs
+        queued earlier are counted ahead of it
+        """
+        position = self.queue.put_ranked((priority, next(self._seq), run_id, config))
+        log.info(f"Queued run {run_id} (priority={priority}, position={position})")
+        return position
+
+    def _worker_loop(self, pipeline: Callable[[str, dict], None]):
+        while True:
+            _, _, run_id, config = self.queue.get()
+            try:
+                pipeline(run_id, config)
+            except Exception as e:
+                log.exception(f"Run {run_id} crashed in worker: {e}")
+            finally:
+                self.queue.task_done()
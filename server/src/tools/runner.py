@@ -8,12 +8,14 @@ import shutil
 from datetime import datetime
 from typing import Dict, Any
 from pathlib import Path
-from .minio_client import upload_dir, upload_file
+from .minio_client import upload_dir, upload_dir_bundled, upload_file
 import logging
 
 log = logging.getLogger(__name__)
 
 BASE_RUN_DIR = Path(os.getenv("UIDAI_RUNS_DIR", "/tmp/uidai_runs"))
+# Upload test artifacts as a single <runId>/artifacts.tar.gz instead of per file
+BUNDLE_ARTIFACTS = os.getenv("MINIO_BUNDLE_ARTIFACTS", "0") == "1"
 
 def make_run_dir(run_id: str) -> Path:
     d = BASE_RUN_DIR / run_id
@@ -91,7 +93,10 @@ def run_playwright_tests(run_id: str, gen_dir: str, headed: bool = False, playwr
     if artifacts_dir.exists() and any(artifacts_dir.iterdir()):
         try:
             log.info(f"Uploading artifacts from: {artifacts_dir}")
-            uploaded = upload_dir(run_id, str(artifacts_dir))
+            if BUNDLE_ARTIFACTS:
+                uploaded = upload_dir_bundled(run_id, str(artifacts_dir), "artifacts")
+            else:
+                uploaded = upload_dir(run_id, str(artifacts_dir))
             log.info(f"Uploaded {len(uploaded)} artifacts")
         except Exception as e:
             log.exception("MinIO upload artifacts failed: %s", e)